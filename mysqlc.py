@@ -1,27 +1,40 @@
 #!/usr/bin/env python3
+import time
+startup_clock = time.perf_counter()  # Start of the --profile-startup timeline
 import os
+import io
+import re
+import sys
+import csv
+import array
+import decimal
+import json
+import math
+import hashlib
+import bisect
+import itertools
+import collections
+import sqlite3
+import threading
+import queue
+import concurrent.futures
 import mysql.connector
-import time
 import argparse
-from prompt_toolkit import PromptSession
-from prompt_toolkit.history import FileHistory
-from prompt_toolkit.key_binding import KeyBindings, KeyPressEvent
-from prompt_toolkit.shortcuts.prompt import PromptSession
-from prompt_toolkit.filters import Condition
-from prompt_toolkit.keys import Keys
-from prompt_toolkit.lexers import PygmentsLexer
-from pygments.lexers.sql import MySqlLexer
-from prompt_toolkit.completion import NestedCompleter, WordCompleter
-from prompt_toolkit.application import get_app # Import get_app
+# prompt_toolkit and pygments are imported lazily by create_prompt_session()
 
 version = 0.20
 
-# History file path
+# History file path (prompt_toolkit input history) and the indexed store of executed statements
 history_file = os.path.expanduser('~/.mysqlc.history')
-history = {} 
+history_db_file = os.path.expanduser('~/.mysqlc.history.db')
+history_db = None
+
+# Local cache directory (schema snapshots etc.)
+cache_dir = os.path.expanduser('~/.mysqlc.cache')
 
 # Setup global configuration
-gemini_api_key = os.environ["GEMINI_API_KEY"]
+gemini_api_key = os.getenv("GEMINI_API_KEY")
+gemini_model_cache_file = os.path.join(cache_dir, 'gemini_model.json')
 
 # Database connection details from environment variables
 db_config = {
@@ -31,24 +44,160 @@ db_config = {
     'database': os.getenv('DB_DATABASE')
 }
 
-validSqlCommands = ("SELECT", "USE", "SHOW", "DESC","UPDATE", "INSERT", "DELETE", "CREATE", "ALTER", "DROP")
+validSqlCommands = ("SELECT", "USE", "SHOW", "DESC","UPDATE", "INSERT", "DELETE", "CREATE", "ALTER", "DROP", "SET")
 validGenAISqlCommands = ("SELECT", "USE", "SHOW", "DESC")
-GenAICurrentSchema = None
-sql_completer = WordCompleter([], ignore_case=True)
+genai_chats = collections.OrderedDict()  # (model, schema fingerprint) -> chat session state, see genai_chat()
+schema_tables_cache = {}  # cache_key -> (fingerprint, tables)
+sql_completer = None  # Created with the prompt session
+
+sql_keywords = [
+    "SELECT", "FROM", "WHERE", "AND", "OR", "INSERT", "UPDATE", "DELETE",
+    "CREATE", "ALTER", "DROP", "TABLE", "DATABASE", "INDEX", "VIEW",
+    "USE", "SHOW", "DESCRIBE", "EXPLAIN", "GRANT", "REVOKE", "COMMIT",
+    "ROLLBACK", "SAVEPOINT", "SET", "NULL", "TRUE", "FALSE", "LIMIT",
+    "ORDER BY", "GROUP BY", "HAVING", "JOIN", "INNER", "LEFT", "RIGHT",
+    "FULL", "OUTER", "ON", "AS", "DISTINCT", "COUNT", "SUM", "AVG", "MIN",
+    "MAX", "CASE", "WHEN", "THEN", "ELSE", "END", "IN", "NOT IN", "BETWEEN",
+    "LIKE", "ILIKE", "IS", "NOT", "EXISTS", "ANY", "ALL", "SOME", "UNION",
+    "INTERSECT", "EXCEPT", "WITH", "RECURSIVE", "PRIMARY KEY", "FOREIGN KEY",
+    "UNIQUE", "CONSTRAINT", "AUTO_INCREMENT", "DEFAULT", "CHECK", "COLUMN",
+    "VARCHAR", "INT", "BIGINT", "TEXT", "DATE", "DATETIME", "TIMESTAMP", "ENUM",
+    "BOOLEAN", "DECIMAL" # Add more SQL keywords as needed
+]
+
+# Words after which only table names make sense
+table_context_keywords = ("FROM", "JOIN", "UPDATE", "INTO", "TABLE", "DESC", "DESCRIBE", "TRUNCATE")
+
+# Sorted prefix index used by the completer, replaced as a whole when the schema changes
+completion_index = None
+session = None
+startup_phases = []  # (phase, seconds) for --profile-startup
+
+# Client-side settings, adjustable from the command line or with backslash commands
+client_settings = {
+    'stream': False,             # Stream result sets instead of fetching them whole
+    'stream_sample_rows': 200,   # Rows used to size columns when streaming
+    'stream_batch_rows': 500,    # Rows requested per fetchmany() when streaming
+    'schema_refresh_interval': 60,  # Seconds between background schema re-checks (0 disables)
+    'genai_top_tables': 15,      # Most relevant tables sent to GenAI when the schema is too big
+    'genai_schema_tokens': 4000, # Approximate token budget for the schema sent to GenAI
+    'translation_cache': True,   # Reuse earlier GenAI translations of the same question
+    'translation_cache_entries': 1000,
+    'translation_cache_days': 30,
+    'gemini_model_ttl': 7 * 86400,  # Seconds the chosen Gemini model name is cached on disk
+    'show_timing': False,        # Print the execute/fetch/convert/render breakdown after each statement
+    'auto_explain': 0,           # Explain SELECTs slower than this many seconds (0 disables)
+    'explain_row_warning': 100000,  # Row estimates above this are flagged by \explain
+    'statement_timeout': 0,      # Seconds before a running statement is killed (0 disables)
+    'output_file': None,         # Set by \o, result sets are exported here instead of printed
+    'export_batch_rows': 10000,  # Rows per fetchmany()/write batch when exporting
+    'fanout_workers': 16,        # Hosts queried at the same time by \fanout
+    'chunk_rows': 1000,          # Primary key values per \chunk batch
+    'chunk_max_threads_running': 32,  # \chunk pauses while Threads_running is above this
+    'chunk_max_replica_lag': 5,  # ... or while replication lag is above this many seconds
+    'chunk_replicas': None,      # Group or comma-separated profiles whose lag \chunk watches
+    'load_local_infile': True,   # \load uses LOAD DATA LOCAL INFILE for CSV when the server allows it
+    'load_batch_rows': 1000,     # Rows per multi-row INSERT when \load inserts itself
+    'load_workers': 4,           # Connections \load inserts on
+    'last_results': 10,          # Result sets kept for \last (0 disables)
+    'last_results_mb': 64,       # Memory cap for the kept result sets
+    'genai_history_tokens': 8000,  # Approximate token budget for the GenAI conversation history
+    'browse_rows': 0,            # Rows per \browse page (0 fits the terminal)
+    'compare_chunk_rows': 10000, # Rows per checksummed \compare range
+    'compare_row_level': 200,    # Differing ranges up to this size are compared row by row
+    'compare_workers': 4,        # Connections per host used by \compare
+}
+
+# File formats supported by \o and INTO LOCAL, by extension
+export_formats = {'.csv': 'csv', '.jsonl': 'jsonl', '.ndjson': 'jsonl', '.parquet': 'parquet'}
+
+# Latest schema loaded by the background worker, swapped as one (database, tables, schema_str) tuple
+schema_snapshot = (None, {}, "")
+schema_requested_database = None
+schema_loaded = threading.Event()
+schema_refresh_requests = queue.Queue()
+
+# Token index over the current schema for GenAI table selection, as (tables, index)
+schema_token_index = (None, None)
+
+# Cache of question -> SQL translations, opened on first use
+translation_cache_file = os.path.join(cache_dir, 'translations.db')
+translation_cache_db = None
+translation_cache_stats = {'hits': 0, 'misses': 0}
+
+# Recent result sets kept column-wise for \last, newest first
+last_results = collections.deque()
+
+# Per-statement phase timings for \stats, and latencies grouped by statement digest
+statement_timings = collections.deque(maxlen=100000)
+digest_latencies = {}  # digest text -> list of total seconds
+timing_phases = ("execute", "fetch", "convert", "render")
+
+# The last \digests listing, for \explain #N
+last_digests = []
+
+# Connection used only to send KILL QUERY for the main connection
+control_conn = None
+
+# Named connection profiles, and the open connection and session state of every profile used so far
+profiles_file = os.path.expanduser('~/.mysqlc.profiles.json')
+active_profile = "default"
+profile_sessions = {}  # profile name -> {'conn', 'config', 'session_statements'}
+
+# Backslash commands (e.g. \stream on), name -> (handler, help text)
+meta_commands = {}
 
     
-bindings = KeyBindings()    
-@bindings.add('tab')
-def _(event: KeyPressEvent):
-    "Allow tabs to be inserted as input."
-    event.app.current_buffer.insert_text("  ")
-       
-session = PromptSession(
-    history=FileHistory(history_file),
-    multiline=True,
-    key_bindings=bindings,
-    completer=sql_completer  # Add the completer to the session
-)
+def create_prompt_session(syntax_highlighting=False):
+    """Imports prompt_toolkit (and pygments if needed) and creates the interactive session."""
+    global session, sql_completer
+    from prompt_toolkit import PromptSession
+    from prompt_toolkit.history import FileHistory
+    from prompt_toolkit.key_binding import KeyBindings, KeyPressEvent
+    from prompt_toolkit.completion import Completer, Completion
+
+    class SqlCompleter(Completer):
+        "Context-aware completion served from completion_index."
+        def get_completions(self, document, complete_event):
+            for word, start_position in sql_completions(document.text_before_cursor, document.text):
+                yield Completion(word, start_position=start_position)
+
+    bindings = KeyBindings()
+    @bindings.add('tab')
+    def _(event: KeyPressEvent):
+        "Allow tabs to be inserted as input."
+        event.app.current_buffer.insert_text("  ")
+
+    lexer = None
+    if syntax_highlighting:
+        from prompt_toolkit.lexers import PygmentsLexer
+        from pygments.lexers.sql import MySqlLexer
+        lexer = PygmentsLexer(MySqlLexer)
+
+    sql_completer = SqlCompleter()
+    session = PromptSession(
+        history=FileHistory(history_file),
+        multiline=True,
+        key_bindings=bindings,
+        lexer=lexer,
+        completer=sql_completer  # Add the completer to the session
+    )
+    return session
+
+def mark_startup_phase(name):
+    """Records the time spent since the previous startup phase."""
+    global startup_clock
+    now = time.perf_counter()
+    startup_phases.append((name, now - startup_clock))
+    startup_clock = now
+
+def print_startup_profile():
+    """Prints the per-phase startup timings collected by mark_startup_phase()."""
+    total = sum(seconds for _name, seconds in startup_phases)
+    print(" -- Startup profile:")
+    for name, seconds in startup_phases:
+        print(f"    {name:<28} {seconds * 1000:8.1f} ms")
+    print(f"    {'total':<28} {total * 1000:8.1f} ms")
 
 def get_top_flash_model():
     """
@@ -56,16 +205,27 @@ def get_top_flash_model():
     with "models/" removed from the strings.  The list is sorted with the latest models
     appearing first.
 
+    The chosen name is cached on disk for gemini_model_ttl seconds, so the
+    list_models() round trip is not paid on every start.
+
     Returns:
-        list: A sorted list of matching model names.
+        str: The newest matching model name.
     """
+    try:
+        with open(gemini_model_cache_file, 'r') as f:
+            cached = json.load(f)
+        if time.time() - cached['fetched_at'] < client_settings['gemini_model_ttl']:
+            print(f"   -- Using Gemini model: {cached['model']}")
+            return cached['model']
+    except (OSError, ValueError, KeyError):
+        pass  # No usable cached model name, ask the API
+
     import google.generativeai as genai
     global gemini_api_key
 
     genai.configure(api_key=gemini_api_key)
 
     try:
-        genai.configure(api_key=os.environ.get("GEMINI_API_KEY"))
         models = genai.list_models()
         filtered_models = [model.name.replace("models/", "") for model in models if "flash" in model.name and not "preview" in model.name and not "thinking" in model.name]
 
@@ -74,17 +234,56 @@ def get_top_flash_model():
     except Exception as e:
         return
     print(f"   -- Using Gemini model: {filtered_models[0]}")
+    try:
+        os.makedirs(os.path.dirname(gemini_model_cache_file), mode=0o700, exist_ok=True)
+        with open(gemini_model_cache_file, 'w') as f:
+            json.dump({'model': filtered_models[0], 'fetched_at': time.time()}, f)
+    except OSError as e:
+        print(f"Error saving Gemini model name: {e}")
     return filtered_models[0]
 
-def askGemini(query, schema, chat_history=None, default_model_name="gemini-2.0-flash"):
-    import os
+def genai_message_text(message):
+    """Returns the text of a chat message, given as a {"role", "parts"} dict or a genai Content object."""
+    if isinstance(message, dict):
+        return "".join(part["text"] for part in message["parts"])
+    return "".join(part.text for part in message.parts)
+
+def trim_chat_history(history, budget_tokens):
+    """
+    Drops the oldest exchanges until the history fits in about budget_tokens
+    tokens (4 characters per token). The first exchange, which carries the
+    instructions and the schema, is always kept.
+
+    Args:
+        history: Alternating user/model messages.
+        budget_tokens: The token budget.
+
+    Returns:
+        The trimmed history (a new list).
+    """
+    history = list(history)
+    sizes = [len(genai_message_text(message)) for message in history]
+    while len(history) > 4 and sum(sizes) > budget_tokens * 4:
+        del history[2:4], sizes[2:4]  # Oldest question/answer pair after the first one
+    return history
+
+def genai_chat(model_name, session_key):
+    """
+    Returns the long-lived chat session state for a schema fingerprint,
+    creating the model and chat on first use. Only the last few sessions are kept.
+
+    Returns:
+        A dict with the 'chat', the 'schema' last sent on it and the 'pending'
+        thread still reading the previous answer.
+    """
     import google.generativeai as genai
 
-    global gemini_api_key, GenAICurrentSchema
+    key = (model_name, hashlib.sha1(session_key.encode('utf-8')).hexdigest())
+    if key in genai_chats:
+        genai_chats.move_to_end(key)
+        return genai_chats[key]
 
     genai.configure(api_key=gemini_api_key)
-
-    # Create the model
     generation_config = {
         "temperature": 1,
         "top_p": 0.95,
@@ -92,19 +291,57 @@ def askGemini(query, schema, chat_history=None, default_model_name="gemini-2.0-f
         "max_output_tokens": 8192,
         "response_mime_type": "text/plain",
     }
+    model = genai.GenerativeModel(model_name=model_name, generation_config=generation_config)
+    genai_chats[key] = {'chat': model.start_chat(history=[]), 'schema': None, 'pending': None}
+    while len(genai_chats) > 4:
+        genai_chats.popitem(last=False)
+    return genai_chats[key]
 
-    model = genai.GenerativeModel(
-        model_name=default_model_name,
-        generation_config=generation_config,
-    )
+def stream_genai_answer(chat, query, chunks):
+    """
+    Sends query with a streaming response and puts every text chunk on chunks,
+    then None. Runs in its own thread so the answer is always read to the end,
+    which the chat needs to record it in its history.
+    """
+    try:
+        for chunk in chat.send_message(query, stream=True):
+            chunks.put(chunk.text)
+    except Exception as err:  # The google client raises many unrelated error types
+        chunks.put(err)
+    chunks.put(None)
+
+def askGemini(query, schema, chat_history=None, default_model_name="gemini-2.0-flash", session_key=None):
+    """
+    Asks Gemini on the chat session kept for the current schema and prints
+    the answer as it streams in.
 
-    # Initialize chat history if not provided
+    The session is reused for every question on the same schema, so the
+    instructions (and a small schema) are only sent once; on a large schema
+    each question brings the tables relevant to it, presented as additions
+    to what the chat has seen rather than as the whole database. The history
+    is trimmed to genai_history_tokens. Reading stops at the first complete SQL line so it
+    can run right away, while the rest of the answer is read in the background.
+
+    Args:
+        query: The question.
+        schema: The schema context for the question: the whole schema, or a subset of it.
+        chat_history: Earlier messages as {"role", "parts"} dicts (used to rank tables).
+        default_model_name: The Gemini model.
+        session_key: Identifies the schema the chat belongs to (the full schema text).
+
+    Returns:
+        A (text, chat_history) tuple: the answer up to and including the first
+        SQL line, and chat_history with this exchange added and trimmed.
+    """
     if chat_history is None:
         chat_history = []
+    partial = session_key is not None and schema != session_key  # A select_schema_context() subset
+    state = genai_chat(default_model_name, session_key if session_key is not None else schema)
+    if state['pending'] is not None:
+        state['pending'].join()  # The previous answer must be complete before the next question
+    state['chat'].history = trim_chat_history(state['chat'].history, client_settings['genai_history_tokens'])
 
-    chat_session = model.start_chat(history=chat_history)
-    
-    if chat_history == None or len(chat_history)==0: 
+    if state['schema'] is None:
         query = f"""
 You are a MySQL query helper who is helping a database admin in their regular job.
 - Please note that the questions the user is asking assumes you will try to understand the context, the history and respond back with single line valid MySQL query which the admin can execute.
@@ -114,17 +351,23 @@ You are a MySQL query helper who is helping a database admin in their regular jo
 Please see the following schema to understand how to structure the sql to answer the question which follows
 - Note that table names are case sensitive. 
 - YOU MUST NOTE CHANGE THE CASE OF THE TABLE or FIELD NAMES.
-- Here is the schema: 
+- {"Here are the tables relevant to this question (the database has more):" if partial else "Here is the schema:"}
 ---------------
     {schema} 
 ---------------
 \n\n
 {query}
 """
-        GenAICurrentSchema=schema
-
-    if GenAICurrentSchema != schema:
-        GenAICurrentSchema=schema
+    elif state['schema'] != schema and partial:
+        query = f"""
+Here are the tables relevant to the next question. The tables described earlier still exist and the database has more:
+---------------
+    {schema} 
+---------------
+\n\n
+{query}
+"""
+    elif state['schema'] != schema:
         query = f"""
 Please note this is the latest database schema. The question will follow the schema:
 ---------------
@@ -133,25 +376,92 @@ Please note this is the latest database schema. The question will follow the sch
 \n\n
 {query}        
 """
-    response = chat_session.send_message(query)
+    state['schema'] = schema
+
+    chunks = queue.Queue()
+    state['pending'] = threading.Thread(target=stream_genai_answer, args=(state['chat'], query, chunks), daemon=True)
+    state['pending'].start()
+    text = ""
+    while True:
+        chunk = chunks.get()
+        if chunk is None:
+            break
+        if isinstance(chunk, Exception):
+            raise chunk
+        print(chunk, end="", flush=True)
+        text += chunk
+        if any(line.strip().upper().startswith(validGenAISqlCommands) for line in text.split("\n")[:-1]):
+            break  # A complete SQL line is there, the rest is read in the background
+    print()
+
+    chat_history.append({"role": "user", "parts": [{"text": query}]})
+    chat_history.append({"role": "model", "parts": [{"text": text}]})
+    return text, trim_chat_history(chat_history, client_settings['genai_history_tokens'])
+
+def normalize_question(question):
+    """Normalizes a question for translation cache lookups (case, whitespace, trailing punctuation)."""
+    return " ".join(question.lower().split()).rstrip(" ?.!;")
+
+def translation_cache_key(question, schema_str):
+    """Returns the cache key for a question asked against a schema."""
+    schema_fingerprint = hashlib.sha1(schema_str.encode('utf-8')).hexdigest()
+    return hashlib.sha1(f"{schema_fingerprint}\n{normalize_question(question)}".encode('utf-8')).hexdigest()
+
+def open_translation_cache():
+    """Opens (creating if needed) the translation cache database."""
+    global translation_cache_db
+    if translation_cache_db is None:
+        os.makedirs(cache_dir, mode=0o700, exist_ok=True)
+        translation_cache_db = sqlite3.connect(translation_cache_file, isolation_level=None)
+        translation_cache_db.execute("""
+            CREATE TABLE IF NOT EXISTS translations (
+                key TEXT PRIMARY KEY,
+                question TEXT,
+                sql TEXT NOT NULL,
+                created_at REAL,
+                last_used REAL,
+                hits INTEGER DEFAULT 0
+            )""")
+        translation_cache_db.execute("CREATE INDEX IF NOT EXISTS translations_last_used ON translations(last_used)")
+    return translation_cache_db
+
+def get_cached_translation(question, schema_str):
+    """
+    Looks up an earlier translation of question against the same schema.
 
-    # Append the current interaction to the history in the correct format.
-    chat_history.append({
-        "role": "user",  # Changed to "role": "user"
-        "parts": [{"text": query}]
-    })
-    chat_history.append({
-        "role": "model",  # Changed to "role": "model"
-        "parts": [{"text": response.text}]
-    })
+    Returns:
+        The cached SQL, or None on a miss or when the cache is turned off.
+    """
+    if not client_settings['translation_cache']:
+        return None
+    db = open_translation_cache()
+    key = translation_cache_key(question, schema_str)
+    max_age = client_settings['translation_cache_days'] * 86400
+    row = db.execute("SELECT sql FROM translations WHERE key = ? AND created_at >= ?", (key, time.time() - max_age)).fetchone()
+    if row is None:
+        translation_cache_stats['misses'] += 1
+        return None
+    translation_cache_stats['hits'] += 1
+    db.execute("UPDATE translations SET last_used = ?, hits = hits + 1 WHERE key = ?", (time.time(), key))
+    return row[0]
 
-    return response.text, chat_history
+def cache_translation(question, schema_str, sql):
+    """Stores a translation and evicts expired and least recently used entries."""
+    if not client_settings['translation_cache']:
+        return
+    db = open_translation_cache()
+    now = time.time()
+    db.execute("INSERT OR REPLACE INTO translations (key, question, sql, created_at, last_used) VALUES (?, ?, ?, ?, ?)",
+               (translation_cache_key(question, schema_str), normalize_question(question), sql, now, now))
+    db.execute("DELETE FROM translations WHERE created_at < ?", (now - client_settings['translation_cache_days'] * 86400,))
+    db.execute("DELETE FROM translations WHERE key IN (SELECT key FROM translations ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+               (client_settings['translation_cache_entries'],))
 
-def print_formatted_results(cursor, results):
-    """Prints the results in a formatted table."""
+def format_result_lines(cursor, results):
+    """Formats dictionary rows as the lines of a table (no lines for an empty result)."""
 
     if not results:
-        return
+        return []
 
     columns = [desc[0] for desc in cursor.description]  # Extract column names directly
 
@@ -163,20 +473,96 @@ def print_formatted_results(cursor, results):
             value = row[col]
             col_widths[i] = max(col_widths[i], len(str(value) if value is not None else "None"))
 
-    # Print header
+    # Header
+    header = "|" + "|".join(f" {col:<{col_widths[i]}} " for i, col in enumerate(columns)) + "|"
+    separator = "+" + "+".join("-" * (col_widths[i] + 2) for i in range(len(columns))) + "+"
+    lines = [separator, header, separator]
+
+    # Rows
+    for row in results:
+        row_str = "|" + "|".join(f" {str(row[col]) if row[col] is not None else ' None':<{col_widths[i]}} " for i, col in enumerate(columns)) + "|"
+        lines.append(row_str)
+
+    # Footer
+    lines.append(separator)
+    return lines
+
+def print_formatted_results(cursor, results):
+    """Prints the results in a formatted table."""
+    lines = format_result_lines(cursor, results)
+    if lines:
+        print("\n".join(lines))
+
+def format_cell(value, width):
+    """Formats a single cell for streamed output, truncating values wider than the column."""
+    text = str(value) if value is not None else ' None'
+    if len(text) > width:
+        text = text[:max(width - 3, 0)] + "..."
+    return f" {text:<{width}} "
+
+def fetch_batches(cursor, batch_size, timings=None):
+    """Yields lists of rows from an unbuffered cursor using fetchmany(), adding the fetch time to timings."""
+    while True:
+        start_time = time.time()
+        rows = cursor.fetchmany(batch_size)
+        if timings is not None:
+            timings['fetch'] += time.time() - start_time
+        if not rows:
+            break
+        yield rows
+
+def print_streamed_results(columns, batches, sample_size=None, timings=None):
+    """
+    Prints rows in a formatted table while they are still being fetched.
+
+    Column widths are taken from the first sample_size rows; later values that
+    do not fit are truncated, so memory use does not depend on the result size.
+
+    Args:
+        columns: The column names.
+        batches: An iterable of lists of tuple rows.
+        sample_size: Number of leading rows used to size the columns.
+        timings: Optional dict whose 'convert' and 'render' entries are increased.
+
+    Returns:
+        The number of rows printed.
+    """
+    if sample_size is None:
+        sample_size = client_settings['stream_sample_rows']
+
+    batches = iter(batches)
+    sample = []
+    for batch in batches:
+        sample.extend(batch)
+        if len(sample) >= sample_size:
+            break
+    if not sample:
+        return 0
+
+    col_widths = [len(col) for col in columns]
+    for row in sample:
+        for i, value in enumerate(row):
+            col_widths[i] = max(col_widths[i], len(str(value) if value is not None else ' None'))
+
     header = "|" + "|".join(f" {col:<{col_widths[i]}} " for i, col in enumerate(columns)) + "|"
     separator = "+" + "+".join("-" * (col_widths[i] + 2) for i in range(len(columns))) + "+"
     print(separator)
     print(header)
     print(separator)
 
-    # Print rows
-    for row in results:
-        row_str = "|" + "|".join(f" {str(row[col]) if row[col] is not None else ' None':<{col_widths[i]}} " for i, col in enumerate(columns)) + "|"
-        print(row_str)
+    row_count = 0
+    for batch in itertools.chain([sample], batches):
+        start_time = time.time()
+        lines = ["|" + "|".join(format_cell(value, col_widths[i]) for i, value in enumerate(row)) + "|" for row in batch]
+        render_start = time.time()
+        print("\n".join(lines))
+        if timings is not None:
+            timings['convert'] += render_start - start_time
+            timings['render'] += time.time() - render_start
+        row_count += len(batch)
 
-    # Print footer
     print(separator)
+    return row_count
 
 def extract_sql_command(sql_string):
     """
@@ -200,19 +586,250 @@ def extract_sql_command(sql_string):
 
 
 
-def reconnect(conn_params):
-    """Attempts to reconnect to the MySQL server."""
+# Client errors that mean the server went away and a new connection may succeed
+RECONNECT_ERRORS = frozenset((
+    mysql.connector.errorcode.CR_SERVER_LOST,
+    mysql.connector.errorcode.CR_SERVER_GONE_ERROR,
+    mysql.connector.errorcode.CR_CONN_HOST_ERROR,
+    mysql.connector.errorcode.CR_CONNECTION_ERROR,
+))
+
+# SET statements that change session state (not SET GLOBAL/PERSIST/PASSWORD or the next-transaction-only SET TRANSACTION)
+SESSION_STATEMENT_RE = re.compile(
+    r"^\s*SET\s+(?!(?:GLOBAL|PERSIST|PERSIST_ONLY|PASSWORD|TRANSACTION|DEFAULT\s+ROLE)\b|@@(?:GLOBAL|PERSIST)\.)",
+    re.IGNORECASE)
+
+def reconnect(conn_params, session_statements=(), max_attempts=6, max_delay=8.0):
+    """
+    Reconnects to the MySQL server with bounded exponential backoff and
+    replays the session state on the new connection.
+
+    Args:
+        conn_params: Connection settings; 'database' restores the current database.
+        session_statements: SET statements to run again on the new connection.
+        max_attempts: Connection attempts before giving up.
+        max_delay: Upper bound in seconds for the wait between attempts.
+
+    Returns:
+        The new connection, with autocommit off like the main connection.
+
+    Raises:
+        mysql.connector.Error: If the server stays unreachable or refuses the connection.
+    """
+    delay = 0.25
+    for attempt in range(1, max_attempts + 1):
+        try:
+            cnx = mysql.connector.connect(**conn_params)
+            break
+        except mysql.connector.Error as err:
+            if err.errno not in RECONNECT_ERRORS or attempt == max_attempts:
+                raise
+            print(f"Reconnecting in {delay:g} sec (attempt {attempt + 1} of {max_attempts})...")
+            time.sleep(delay)
+            delay = min(delay * 2, max_delay)
+    cnx.autocommit = False
+    if session_statements:
+        replay_cur = cnx.cursor()
+        for statement in session_statements:
+            replay_cur.execute(statement)
+        replay_cur.close()
+    return cnx
+
+def read_profiles_file():
+    """
+    Reads profiles_file, a JSON object like
+    {"profiles": {"replica1": {"host": "10.0.0.12", "database": "app"}},
+     "groups": {"replicas": ["replica1", "replica2"]}}.
+
+    Returns:
+        The parsed object, empty if there is no (valid) file.
+    """
+    try:
+        with open(profiles_file) as f:
+            data = json.load(f)
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as err:
+        print(f"Error reading {profiles_file}: {err}")
+        return {}
+    return data if isinstance(data, dict) else {}
+
+# Keyword arguments mysql.connector.connect() accepts; anything else in a profile is a typo
+PROFILE_SETTINGS = (frozenset(mysql.connector.constants.DEFAULT_CONFIGURATION)
+                    | frozenset(mysql.connector.constants.CNX_POOL_ARGS)
+                    | {"option_files", "option_groups", "failover"})
+
+def profiles_section(key, entry_type):
+    """
+    Returns the key section of profiles_file ("profiles" or "groups") as a
+    dict, leaving out (and reporting) entries that are not of entry_type.
+    """
+    section = read_profiles_file().get(key, {})
+    if not isinstance(section, dict):
+        print(f"Ignoring \"{key}\" in {profiles_file}: it must be an object")
+        return {}
+    invalid = sorted(name for name, entry in section.items() if not isinstance(entry, entry_type))
+    if invalid:
+        print(f"Ignoring malformed {key} in {profiles_file}: {', '.join(invalid)}")
+    return {name: entry for name, entry in section.items() if isinstance(entry, entry_type)}
+
+def load_profiles():
+    """Returns a dict of profile name -> connection settings from profiles_file."""
+    return profiles_section('profiles', dict)
+
+def load_profile_groups():
+    """Returns a dict of group name -> list of profile names from profiles_file."""
+    return profiles_section('groups', list)
+
+def profile_config(name):
+    """
+    Returns the connection settings for a profile. Settings the profile leaves
+    out (user, password, port, ...) come from the startup connection.
+
+    Args:
+        name: The profile name; "default" is the connection mysqlc was started with.
+
+    Returns:
+        A new settings dict, or None if the profile is not defined or has
+        settings mysql.connector does not know (reported on the spot).
+    """
+    if name in profile_sessions:
+        return dict(profile_sessions[name]['config'])
+    profiles = load_profiles()
+    if name not in profiles:
+        return None
+    unsupported = sorted(set(profiles[name]) - PROFILE_SETTINGS)
+    if unsupported:
+        print(f"Profile {name} in {profiles_file} has unsupported settings: {', '.join(unsupported)}")
+        return None
+    config = dict(profile_sessions['default']['config'])
+    config.update(profiles[name])
+    return config
+
+def remember_session_statement(sql):
+    """Records a session-level SET statement so reconnects and profile switches can replay it."""
+    if SESSION_STATEMENT_RE.match(sql):
+        statements = profile_sessions[active_profile]['session_statements']
+        if sql in statements:
+            statements.remove(sql)  # Keep only the latest position, order matters for replay
+        statements.append(sql)
+
+def reconnect_active_profile():
+    """Reconnects the current profile, restoring its database and SET variables."""
+    state = profile_sessions[active_profile]
+    state['conn'] = reconnect(db_config, state['session_statements'])
+    return state['conn']
+
+def reconnect_or_report():
+    """
+    Like reconnect_active_profile(), but reports a server that stays
+    unreachable instead of raising, so the prompt stays up.
+
+    Returns:
+        The new connection, or None; the next statement tries again.
+    """
     try:
-        cnx = mysql.connector.connect(**conn_params)
-        return cnx
+        return reconnect_active_profile()
     except mysql.connector.Error as err:
-        if err.errno == mysql.connector.errorcode.CR_SERVER_LOST:
-            print("Reconnecting...")
-            time.sleep(2)  # Optional: Wait before retrying
-            return reconnect(conn_params)  # Recursive call to retry
-        else:
-            raise err  # Re-raise other MySQL errors
-        
+        print(f"Error reconnecting: {err} (the next statement tries again)")
+        return None
+
+SCHEMA_FINGERPRINT_SQL = """
+SELECT DATABASE() AS database_name,
+       COUNT(*) AS table_count,
+       MAX(CREATE_TIME) AS max_create_time,
+       (SELECT CONCAT(COUNT(*), ':', COALESCE(SUM(CRC32(CONCAT_WS('#', TABLE_NAME, ORDINAL_POSITION,
+                                                                 COLUMN_NAME, COLUMN_TYPE, COLUMN_KEY))), 0))
+        FROM information_schema.COLUMNS WHERE TABLE_SCHEMA = DATABASE()) AS column_summary
+FROM information_schema.TABLES
+WHERE TABLE_SCHEMA = DATABASE()
+"""
+
+SCHEMA_COLUMNS_SQL = """
+SELECT TABLE_NAME AS table_name, COLUMN_NAME AS column_name,
+       COLUMN_TYPE AS column_type, COLUMN_KEY AS column_key
+FROM information_schema.COLUMNS
+WHERE TABLE_SCHEMA = DATABASE()
+ORDER BY TABLE_NAME, ORDINAL_POSITION
+"""
+
+def schema_cache_path(cache_key):
+    """Returns the on-disk cache file used for a host/database key."""
+    digest = hashlib.sha1(cache_key.encode('utf-8')).hexdigest()
+    return os.path.join(cache_dir, f"schema-{digest}.json")
+
+def load_schema_cache(cache_key):
+    """Loads a cached (fingerprint, tables) pair from disk, or None if there is none."""
+    try:
+        with open(schema_cache_path(cache_key), 'r') as f:
+            cached = json.load(f)
+        if cached.get('key') != cache_key:
+            return None
+        return cached['fingerprint'], cached['tables']
+    except (OSError, ValueError, KeyError):
+        return None
+
+def save_schema_cache(cache_key, fingerprint, tables):
+    """Writes the schema snapshot to disk, replacing any previous one atomically."""
+    try:
+        os.makedirs(cache_dir, mode=0o700, exist_ok=True)
+        path = schema_cache_path(cache_key)
+        with open(path + '.tmp', 'w') as f:
+            json.dump({'key': cache_key, 'fingerprint': fingerprint, 'tables': tables}, f)
+        os.replace(path + '.tmp', path)
+    except OSError as e:
+        print(f"Error saving schema cache: {e}")
+
+def get_schema_tables(cursor):
+    """
+    Retrieves the columns of all tables in the current database.
+
+    A cheap fingerprint (table and column counts, a checksum of every column's
+    name, position, type and key, and the latest table create time) is
+    checked first; the full column list is only fetched, in a single
+    information_schema query, when it does not match the in-memory or on-disk
+    cache. Renames and in-place type changes change the fingerprint, data
+    changes (which move UPDATE_TIME) do not.
+
+    Args:
+        cursor: A dictionary cursor on the current connection.
+
+    Returns:
+        A dict mapping table name to a list of [column, type, key] entries.
+    """
+    cursor.execute(SCHEMA_FINGERPRINT_SQL)
+    row = cursor.fetchall()[0]
+    database = row['database_name']
+    if not database:
+        return {}
+
+    fingerprint = f"{row['table_count']}:{row['column_summary']}:{row['max_create_time']}"
+    cache_key = f"{db_config.get('user')}@{db_config.get('host')}:{db_config.get('port', 3306)}/{database}"
+
+    cached = schema_tables_cache.get(cache_key) or load_schema_cache(cache_key)
+    if cached and cached[0] == fingerprint:
+        schema_tables_cache[cache_key] = cached
+        return cached[1]
+
+    cursor.execute(SCHEMA_COLUMNS_SQL)
+    tables = {}
+    for column in cursor.fetchall():
+        tables.setdefault(column['table_name'], []).append(
+            [column['column_name'], column['column_type'], column['column_key']])
+
+    schema_tables_cache[cache_key] = (fingerprint, tables)
+    save_schema_cache(cache_key, fingerprint, tables)
+    return tables
+
+def format_database_schema(tables):
+    """Formats the tables returned by get_schema_tables() as the schema string used for GenAI."""
+    schema_str = ""
+    for table, columns in tables.items():
+        schema_str += f"\n{table} = "
+        for column, column_type, _key in columns:
+            schema_str += f"  {column}: {column_type} , "
+    return schema_str
+
 def get_database_schema(cursor):
     """
     Retrieves the schema of all tables in the current database.
@@ -223,23 +840,183 @@ def get_database_schema(cursor):
     Returns:
         A string containing the schema of all tables.
     """
+    return format_database_schema(get_schema_tables(cursor))
+
+def identifier_tokens(text):
+    """Splits identifiers and words into lowercase tokens, e.g. "orderItems_2" -> order, item, 2."""
+    tokens = []
+    for word in re.findall(r"[A-Z]+(?![a-z])|[A-Z]?[a-z]+|[0-9]+", text):
+        word = word.lower()
+        if len(word) > 3 and word.endswith("s") and not word.endswith(("ss", "us")):
+            word = word[:-1]  # Crude singular form so "orders" matches "order"
+        tokens.append(word)
+    return tokens
+
+def build_schema_token_index(tables):
+    """
+    Builds an inverted index from name tokens to weighted tables.
 
-    cursor.execute("SHOW TABLES")
-    tables = [table for table in cursor.fetchall()]
-
-    schema_str = ""
-    for _table in tables:
-        table = (list(_table.values())[0])
-        schema_str += f"\n{table} = "
-        cursor.execute(f"DESCRIBE {table}")
-        columns = cursor.fetchall()
+    Table name tokens weigh more than column name tokens, and every token is
+    scaled by its inverse document frequency so common names like "id" count little.
+    """
+    postings = {}
+    for table, columns in tables.items():
+        for token in identifier_tokens(table):
+            postings.setdefault(token, {})[table] = 3.0
         for column in columns:
-            schema_str += f"  {column['Field']}: {column['Type']} , "
+            for token in identifier_tokens(column[0]):
+                weights = postings.setdefault(token, {})
+                weights[table] = max(weights.get(table, 0.0), 1.0)
+    table_count = max(len(tables), 1)
+    for token, weights in postings.items():
+        idf = math.log(1 + table_count / len(weights))
+        for table in weights:
+            weights[table] *= idf
+    return postings
+
+def select_schema_context(tables, question, chat_history=None):
+    """
+    Picks the part of the schema worth sending to GenAI for a question.
+
+    Small schemas are sent whole. Otherwise tables are ranked by token overlap
+    between their table/column names and the question plus the last model
+    answers in chat_history (which name the tables of earlier queries), and the
+    top genai_top_tables are sent, followed by the names of other tables, within
+    about genai_schema_tokens tokens (4 characters per token).
+
+    Args:
+        tables: The tables returned by get_schema_tables().
+        question: The user's question.
+        chat_history: The GenAI conversation so far.
+
+    Returns:
+        The schema string for the prompt.
+    """
+    global schema_token_index
+    budget_chars = client_settings['genai_schema_tokens'] * 4
+    full_schema = format_database_schema(tables)
+    if len(full_schema) <= budget_chars:
+        return full_schema
+
+    if schema_token_index[0] is not tables:
+        schema_token_index = (tables, build_schema_token_index(tables))
+    postings = schema_token_index[1]
+
+    scores = {}
+    weighted_texts = [(question, 1.0)]
+    for message in (chat_history or [])[-4:]:
+        if message.get("role") == "model":
+            weighted_texts.append((message["parts"][0]["text"], 0.5))
+    for text, text_weight in weighted_texts:
+        for token in set(identifier_tokens(text)):
+            if token.isdigit():
+                continue  # "top 10" says nothing about tables
+            for table, weight in postings.get(token, {}).items():
+                scores[table] = scores.get(table, 0.0) + weight * text_weight
+
+    ranked = sorted(scores, key=scores.get, reverse=True)[:client_settings['genai_top_tables']]
+    schema_str = "\n(Only the tables most relevant to the question are described)"
+    described = set()
+    for table in ranked:
+        table_str = format_database_schema({table: tables[table]})
+        if len(schema_str) + len(table_str) > budget_chars:
+            break
+        schema_str += table_str
+        described.add(table)
+
+    # Every table not described is named, the better scored ones first in case the budget runs out
+    other_tables = sorted((table for table in tables if table not in described), key=lambda table: -scores.get(table, 0.0))
+    if other_tables:
+        schema_str += "\nOther tables: "
+        for table in other_tables:
+            if len(schema_str) + len(table) + 2 + 3 > budget_chars:  # Leaves room for the "..."
+                schema_str += "..."
+                break
+            schema_str += table + ", "
     return schema_str
 
+def open_side_connection(database=None):
+    """Opens an extra autocommit connection with the session's settings, for background work."""
+    config = dict(db_config)
+    if database is not None:
+        config['database'] = database
+    side_conn = mysql.connector.connect(**config)
+    side_conn.autocommit = True
+    return side_conn
+
+def request_schema_refresh(database):
+    """Asks the background worker to (re)load the schema of database."""
+    global schema_requested_database
+    schema_requested_database = database
+    if schema_snapshot[0] != database:
+        schema_loaded.clear()
+    schema_refresh_requests.put(database)
+
+def wait_for_schema(timeout=30):
+    """Waits for the requested database's schema and returns the (database, tables, schema_str) snapshot."""
+    if not schema_loaded.wait(timeout):
+        print(" -- Schema is still loading, continuing without it")
+    return schema_snapshot
+
+def schema_refresh_worker(update_words):
+    """
+    Loads the schema on a dedicated connection whenever the database changes,
+    and re-checks it every schema_refresh_interval seconds so DDL from other
+    sessions is picked up. Results are swapped in as a single tuple.
+
+    Args:
+        update_words: If True, also refresh the completer's word list.
+    """
+    global schema_snapshot
+    side_conn = None
+    side_server = None
+    database = None
+    while True:
+        interval = client_settings['schema_refresh_interval']
+        try:
+            database = schema_refresh_requests.get(timeout=interval if interval > 0 else None)
+            while not schema_refresh_requests.empty():  # Only the latest request matters
+                database = schema_refresh_requests.get_nowait()
+        except queue.Empty:
+            pass  # Periodic re-check of the current database
+
+        if database is None:
+            schema_snapshot = (None, {}, "")
+            schema_loaded.set()
+            continue
+
+        try:
+            server = (db_config.get('host'), db_config.get('port'), db_config.get('user'))
+            if side_conn is not None and side_server != server:  # \connect switched servers
+                side_conn.close()
+                side_conn = None
+            if side_conn is None or not side_conn.is_connected():
+                side_conn = open_side_connection(database)
+                side_server = server
+            elif side_conn.database != database:
+                side_conn.database = database
+            tables = get_schema_tables(side_conn.cursor(dictionary=True))
+        except mysql.connector.Error as err:
+            print(f"Error refreshing schema: {err}")
+            side_conn = None
+            schema_loaded.set()  # Do not keep waiters blocked on a failing refresh
+            continue
+
+        if database != schema_requested_database:
+            continue  # A newer request is queued
+        if schema_snapshot[0] != database or schema_snapshot[1] is not tables:
+            schema_snapshot = (database, tables, format_database_schema(tables))
+            if update_words:
+                update_completer(tables)
+        schema_loaded.set()
+
+def start_schema_refresh(update_words):
+    """Starts the background schema worker thread."""
+    threading.Thread(target=schema_refresh_worker, args=(update_words,), daemon=True).start()
+
 def load_history(history_file):
-    """Loads command history from the history file."""
-    global history
+    """Parses a legacy history file into a dict of row_id: command."""
+    history = {}
     if os.path.exists(history_file):
         with open(history_file, 'r') as f:
             row_id = 1
@@ -266,16 +1043,214 @@ def load_history(history_file):
                 history[row_id] = current_command.strip()
     return history
 
-def save_history(history_file):
-    """Saves command history to the history file."""
-    global history
+def open_history_store(db_file, legacy_file=None):
+    """
+    Opens (creating if needed) the SQLite history store.
+
+    Statements are appended one row at a time, a NOCASE index serves prefix
+    lookups and an FTS5 trigram index, when SQLite supports it, serves
+    substring searches. A new store imports the legacy history file once.
+
+    Args:
+        db_file: Path of the SQLite database.
+        legacy_file: Optional old-style history file to import into a new store.
+
+    Returns:
+        The sqlite3 connection.
+    """
+    global history_db
+    history_db = sqlite3.connect(db_file, isolation_level=None)
+    history_db.execute("PRAGMA journal_mode=WAL")
+    history_db.execute("""
+        CREATE TABLE IF NOT EXISTS history (
+            id INTEGER PRIMARY KEY,
+            command TEXT NOT NULL COLLATE NOCASE,
+            executed_at REAL,
+            database TEXT,
+            duration REAL,
+            rows INTEGER
+        )""")
+    # The legacy import runs before the indexes exist: building them once afterwards is
+    # several times faster than maintaining them (trigram tokenizing above all) per row.
+    if legacy_file and history_db.execute("SELECT COUNT(*) FROM history").fetchone()[0] == 0:
+        legacy = load_history(legacy_file)
+        with history_db:
+            history_db.execute("BEGIN")
+            history_db.executemany("INSERT INTO history (command) VALUES (?)", ((cmd,) for cmd in legacy.values()))
+    if not has_history_fts():
+        try:
+            with history_db:
+                history_db.execute("BEGIN")
+                history_db.execute("""
+                    CREATE VIRTUAL TABLE history_fts
+                    USING fts5(command, content='history', content_rowid='id', tokenize='trigram')""")
+                history_db.execute("""
+                    CREATE TRIGGER history_fts_insert AFTER INSERT ON history BEGIN
+                        INSERT INTO history_fts(rowid, command) VALUES (new.id, new.command);
+                    END""")
+                history_db.execute("INSERT INTO history_fts(history_fts) VALUES ('rebuild')")
+        except sqlite3.OperationalError:
+            pass  # No FTS5/trigram support, substring search falls back to LIKE
+    # Created after the rebuild: while this covering index exists, the rebuild reads
+    # history in command order and FTS5 slows down badly on rowids out of order.
+    history_db.execute("CREATE INDEX IF NOT EXISTS history_command ON history(command)")
+    return history_db
+
+def has_history_fts():
+    """Returns True if the history store has a full-text index."""
+    return history_db.execute(
+        "SELECT 1 FROM sqlite_master WHERE name = 'history_fts'").fetchone() is not None
+
+def add_history(command, database=None, duration=None, rows=None):
+    """Appends an executed statement and its metadata to the history store."""
     try:
-        with open(history_file, 'w') as f:
-            for row_id, cmd in history.items():
-                f.write(f"{cmd}\n")
-    except Exception as e:
+        history_db.execute(
+            "INSERT INTO history (command, executed_at, database, duration, rows) VALUES (?, ?, ?, ?, ?)",
+            (command, time.time(), database, duration, rows))
+    except sqlite3.Error as e:
         print(f"Error saving history: {e}")
 
+def get_history(row_id):
+    """Returns the statement with the given history id, or None."""
+    row = history_db.execute("SELECT command FROM history WHERE id = ?", (row_id,)).fetchone()
+    return row[0] if row else None
+
+def recent_history(limit=100):
+    """Returns the last limit (id, command) entries, oldest first."""
+    rows = history_db.execute("SELECT id, command FROM history ORDER BY id DESC LIMIT ?", (limit,)).fetchall()
+    return rows[::-1]
+
+def search_history(text, limit=100):
+    """
+    Finds history entries containing text (case-insensitive).
+
+    Returns:
+        A list of (id, command, executed_at, database, duration, rows), oldest first.
+    """
+    columns = "h.id, h.command, h.executed_at, h.database, h.duration, h.rows"
+    if len(text) >= 3 and has_history_fts():
+        rows = history_db.execute(
+            f"SELECT {columns} FROM history_fts f JOIN history h ON h.id = f.rowid "
+            "WHERE history_fts MATCH ? ORDER BY h.id DESC LIMIT ?",
+            ('"' + text.replace('"', '""') + '"', limit)).fetchall()
+    else:
+        pattern = "%" + text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+        rows = history_db.execute(
+            f"SELECT {columns} FROM history h WHERE h.command LIKE ? ESCAPE '\\' ORDER BY h.id DESC LIMIT ?",
+            (pattern, limit)).fetchall()
+    return rows[::-1]
+
+banner_status_variables = (
+    "Threads_running", "Threads_connected", "Threads_cached", "Connections",
+    "Innodb_buffer_pool_read_requests", "Innodb_buffer_pool_reads", "Innodb_row_lock_current_waits",
+    "Created_tmp_disk_tables", "Handler_read_rnd_next", "Qcache_hits", "Select_full_join",
+    "Sort_merge_passes", "Innodb_log_waits", "Questions", "Com_select",
+)
+
+# Counters shown by \top as per-second rates, and gauges shown as current values
+top_rate_variables = (
+    ("Questions", "Queries/s"), ("Com_select", "Selects/s"), ("Com_insert", "Inserts/s"),
+    ("Com_update", "Updates/s"), ("Com_delete", "Deletes/s"), ("Slow_queries", "Slow queries/s"),
+    ("Created_tmp_tables", "Tmp tables/s"), ("Created_tmp_disk_tables", "Tmp disk tables/s"),
+    ("Select_full_join", "Full joins/s"), ("Sort_merge_passes", "Sort merge passes/s"),
+    ("Innodb_row_lock_waits", "Row lock waits/s"), ("Innodb_rows_read", "Rows read/s"),
+    ("Bytes_received", "Bytes in/s"), ("Bytes_sent", "Bytes out/s"), ("Connections", "Connections/s"),
+)
+top_gauge_variables = (
+    ("Threads_running", "Threads running"), ("Threads_connected", "Threads connected"),
+    ("Innodb_row_lock_current_waits", "Current row lock waits"),
+)
+
+# \top's process list sources, best first: the performance_schema tables are read
+# without the global thread-list mutex that information_schema.PROCESSLIST takes
+# (deprecated in MySQL 8.0); performance_schema.processlist needs 8.0.22
+top_processlist_sources = (
+    """SELECT ID, USER, DB, COMMAND, TIME, STATE, INFO
+       FROM performance_schema.processlist
+       WHERE COMMAND NOT IN ('Sleep', 'Daemon', 'Binlog Dump') AND ID <> CONNECTION_ID()
+       ORDER BY TIME DESC LIMIT 15""",
+    """SELECT PROCESSLIST_ID AS ID, PROCESSLIST_USER AS USER, PROCESSLIST_DB AS DB, PROCESSLIST_COMMAND AS COMMAND,
+              PROCESSLIST_TIME AS TIME, PROCESSLIST_STATE AS STATE, PROCESSLIST_INFO AS INFO
+       FROM performance_schema.threads
+       WHERE TYPE = 'FOREGROUND' AND PROCESSLIST_COMMAND NOT IN ('Sleep', 'Daemon', 'Binlog Dump')
+         AND PROCESSLIST_ID <> CONNECTION_ID()
+       ORDER BY PROCESSLIST_TIME DESC LIMIT 15""",
+    """SELECT ID, USER, DB, COMMAND, TIME, STATE, INFO
+       FROM information_schema.PROCESSLIST
+       WHERE COMMAND NOT IN ('Sleep', 'Daemon', 'Binlog Dump') AND ID <> CONNECTION_ID()
+       ORDER BY TIME DESC LIMIT 15""",
+)
+
+def processlist_query(cur):
+    """
+    Picks the first of top_processlist_sources the server can answer. The
+    performance_schema ones are skipped when performance_schema is off,
+    since its tables are then empty rather than missing.
+
+    Args:
+        cur: A dictionary cursor.
+
+    Returns:
+        The query \top polls.
+    """
+    try:
+        cur.execute("SELECT @@performance_schema AS enabled")
+        enabled = int(cur.fetchall()[0]['enabled'] or 0)
+    except mysql.connector.Error:
+        enabled = 0  # Built without performance_schema
+    for sql in top_processlist_sources[:-1] if enabled else ():
+        try:
+            cur.execute(sql)
+            cur.fetchall()
+            return sql
+        except mysql.connector.Error:
+            continue  # Missing table (older server, MariaDB) or no SELECT privilege
+    return top_processlist_sources[-1]
+
+def fetch_global_status(cur, names):
+    """
+    Reads the given global status variables, filtering on the server side.
+
+    Args:
+        cur: A dictionary cursor.
+        names: The variable names.
+
+    Returns:
+        A dict of variable name to int for the variables the server has.
+    """
+    placeholders = ", ".join(["%s"] * len(names))
+    cur.execute(f"SHOW GLOBAL STATUS WHERE Variable_name IN ({placeholders})", tuple(names))
+    status = {}
+    for var in cur.fetchall():
+        try:
+            status[var['Variable_name']] = int(var['Value'])
+        except (TypeError, ValueError):
+            pass  # Non-numeric status value
+    return status
+
+def status_rates(previous, current, elapsed):
+    """
+    Computes per-second rates and window ratios between two status snapshots.
+
+    Returns:
+        A list of (label, formatted value) pairs.
+    """
+    lines = []
+    for name, label in top_gauge_variables:
+        if name in current:
+            lines.append((label, f"{current[name]}"))
+
+    reads = current.get("Innodb_buffer_pool_reads", 0) - previous.get("Innodb_buffer_pool_reads", 0)
+    requests = current.get("Innodb_buffer_pool_read_requests", 0) - previous.get("Innodb_buffer_pool_read_requests", 0)
+    if requests > 0:
+        lines.append(("Buffer pool hit ratio", f"{100 - reads / requests * 100:.2f}%"))
+    else:
+        lines.append(("Buffer pool hit ratio", "-"))
+
+    for name, label in top_rate_variables:
+        if name in current and name in previous:
+            lines.append((label, f"{(current[name] - previous[name]) / elapsed:,.1f}"))
+    return lines
 
 def infobanner(cur):
     """Displays the info banner with current load/busyness metrics, including some as percentages."""
@@ -287,6 +1262,16 @@ mysqlc: A modern MySQL client
 - Source: https://github.com/royans/mysqlc
 """)
 
+    print_server_status(cur)
+
+    print("""
+Note: Press "ALT+Enter" to execute command.
+------------------------------------------------          
+""")
+
+def print_server_status(cur):
+    """Prints the server version, uptime and important global status variables."""
+
     try:
         # Get MySQL version
         cur.execute("SELECT VERSION()")
@@ -304,31 +1289,8 @@ mysqlc: A modern MySQL client
         uptime_string = f"Uptime: {uptime_hours} hours {uptime_minutes} mins"
 
         # Get important status variables
-        cur.execute("SHOW GLOBAL STATUS")
-        status_vars = cur.fetchall()
-
-        important_vars = {
-            "Threads_running": None,
-            "Threads_connected": None,
-            "Threads_cached": None,
-            "Connections": None,
-            "Innodb_buffer_pool_read_requests": None,
-            "Innodb_buffer_pool_reads": None,
-            "Innodb_row_lock_current_waits": None,
-            "Created_tmp_disk_tables": None,
-            "Handler_read_rnd_next": None,
-            "Qcache_hits": None,
-            "Select_full_join": None,
-            "Sort_merge_passes": None,
-            "Innodb_log_waits": None,
-            "Questions": None,
-            "Com_select": None
-        }
-
-        # Extract values for the important variables
-        for var in status_vars:
-            if var['Variable_name'] in important_vars:
-                important_vars[var['Variable_name']] = int(var['Value'])
+        important_vars = dict.fromkeys(banner_status_variables)
+        important_vars.update(fetch_global_status(cur, banner_status_variables))
 
         displayed_vars = []
 
@@ -356,205 +1318,2591 @@ mysqlc: A modern MySQL client
 
     except mysql.connector.Error as err:
         print(f"Error fetching global status: {err}")
-
-    print("""
-Note: Press "ALT+Enter" to execute command.
-------------------------------------------------          
-""")
     
     
-def execute_recent_match(history, partial_command):
+def execute_recent_match(partial_command):
     """
     Finds and executes the most recent command in history that matches the partial command.
 
     Args:
-        history: A dictionary containing command history (row_id: command).
-        partial_command: The partial command to search for.
+        partial_command: The prefix to search for (case-insensitive).
 
     Returns:
-        True if a matching command was found and executed, False otherwise.
+        The matching command if one was found, None otherwise.
     """
-    import re
-
-    matching_commands = []
-    for row_id, command in history.items():
-        if re.search(f"^\\s*{partial_command}", command, re.IGNORECASE): # Improved regex for partial match at the beginning of the command
-            matching_commands.append((row_id, command))
-
-    if matching_commands:
-        # Sort by row_id to get the most recent command
-        matching_commands.sort(reverse=True)
-        most_recent_row_id, most_recent_command = matching_commands[0]
+    prefix = partial_command.strip()
+    # Range scan on the NOCASE index instead of a scan over every entry
+    row = history_db.execute(
+        "SELECT id, command FROM history WHERE command >= ? AND command < ? ORDER BY id DESC LIMIT 1",
+        (prefix, prefix + "\U0010ffff")).fetchone()
+
+    if row:
+        most_recent_row_id, most_recent_command = row
         print(f"Executing: {most_recent_command}")
         return most_recent_command
     else:
         print("No matching command found.")
         return None
 
-def broken_update_completer(cursor):
-    """Updates the WordCompleter with SQL keywords and table/column names."""
-
-    sql_keywords = [
-        "SELECT", "FROM", "WHERE", "AND", "OR", "INSERT", "UPDATE", "DELETE",
-        "CREATE", "ALTER", "DROP", "TABLE", "DATABASE", "INDEX", "VIEW",
-        "USE", "SHOW", "DESCRIBE", "EXPLAIN", "GRANT", "REVOKE", "COMMIT",
-        "ROLLBACK", "SAVEPOINT", "SET", "NULL", "TRUE", "FALSE", "LIMIT",
-        "ORDER BY", "GROUP BY", "HAVING", "JOIN", "INNER", "LEFT", "RIGHT",
-        "FULL", "OUTER", "ON", "AS", "DISTINCT", "COUNT", "SUM", "AVG", "MIN",
-        "MAX", "CASE", "WHEN", "THEN", "ELSE", "END", "IN", "NOT IN", "BETWEEN",
-        "LIKE", "ILIKE", "IS", "NOT", "EXISTS", "ANY", "ALL", "SOME", "UNION",
-        "INTERSECT", "EXCEPT", "WITH", "RECURSIVE", "PRIMARY KEY", "FOREIGN KEY",
-        "UNIQUE", "CONSTRAINT", "AUTO_INCREMENT", "DEFAULT", "CHECK", "COLUMN",
-        "VARCHAR", "INT", "BIGINT", "TEXT", "DATE", "DATETIME", "TIMESTAMP", "ENUM",
-        "BOOLEAN", "DECIMAL" # Add more SQL keywords as needed
-    ]
-
-    table_names = []
-    start_time = time.time()  # Record start time
-    try:
-        cursor.execute("SHOW TABLES")
-        for table in cursor.fetchall():
-            table_names.append(list(table.values()))
-    except mysql.connector.Error as err:
-        print(f"Error fetching table names: {err}")
-        return  # Exit early if there's an error
-    end_time = time.time()  # Record end time
-    table_fetch_time = end_time - start_time  # Calculate execution time
-    print(f"Fetched tables in ({table_fetch_time:.3f} sec)")
-
-    column_names = []
-    start_time = time.time()  # Record start time
-    for table in table_names:
-        try:
-            cursor.execute(f"DESCRIBE {table}")
-            for column in cursor.fetchall():
-                column_names.append(f"{table}.{column['Field']}") # Add table prefix
-        except mysql.connector.Error as err:
-            print(f"Error fetching columns for table {table}: {err}")
-            continue # Skip to the next table if there's an error
-    end_time = time.time()  # Record end time
-    column_fetch_time = end_time - start_time  # Calculate execution time
-    print(f"Fetched columns in ({column_fetch_time:.3f} sec)")
-
-    start_time = time.time()  # Record start time        
-    keyword_completer = WordCompleter(sql_keywords, ignore_case=True)
-    table_completer = WordCompleter(table_names, ignore_case=True)
-    column_completer = WordCompleter(column_names, ignore_case=True)
-
-    global sql_completer
-    sql_completer = NestedCompleter({
-        '.': column_completer,
-        ' ': NestedCompleter({
-            '': table_completer
-        }),
-        '': keyword_completer
-    })
-    end_time = time.time()  # Record end time
-    completer_time = end_time - start_time  # Calculate execution time
-    print(f"sql_completer in ({completer_time:.3f} sec)")
-
-def update_completer(cursor):
-    """Updates the WordCompleter with SQL keywords and table/column names."""
-
-    sql_keywords = [
-        "SELECT", "FROM", "WHERE", "AND", "OR", "INSERT", "UPDATE", "DELETE",
-        "CREATE", "ALTER", "DROP", "TABLE", "DATABASE", "INDEX", "VIEW",
-        "USE", "SHOW", "DESCRIBE", "EXPLAIN", "GRANT", "REVOKE", "COMMIT",
-        "ROLLBACK", "SAVEPOINT", "SET", "NULL", "TRUE", "FALSE", "LIMIT",
-        "ORDER BY", "GROUP BY", "HAVING", "JOIN", "INNER", "LEFT", "RIGHT",
-        "FULL", "OUTER", "ON", "AS", "DISTINCT", "COUNT", "SUM", "AVG", "MIN",
-        "MAX", "CASE", "WHEN", "THEN", "ELSE", "END", "IN", "NOT IN", "BETWEEN",
-        "LIKE", "ILIKE", "IS", "NOT", "EXISTS", "ANY", "ALL", "SOME", "UNION",
-        "INTERSECT", "EXCEPT", "WITH", "RECURSIVE", "PRIMARY KEY", "FOREIGN KEY",
-        "UNIQUE", "CONSTRAINT", "AUTO_INCREMENT", "DEFAULT", "CHECK", "COLUMN",
-        "VARCHAR", "INT", "BIGINT", "TEXT", "DATE", "DATETIME", "TIMESTAMP", "ENUM",
-        "BOOLEAN", "DECIMAL" # Add more SQL keywords as needed
-    ]
-
-    table_names = []
-    cursor.execute("SHOW TABLES")
-    for table in cursor.fetchall():
-        table_names.append(list(table.values())[0])
-
-    column_names = []
-    for table in table_names:
-        cursor.execute(f"DESCRIBE {table}")
-        for column in cursor.fetchall():
-           column_names.append(f"{table}.{column['Field']}") # Add table prefix
-
-    all_completions = sql_keywords + table_names + column_names
-    sql_completer.words = all_completions  # Update the WordCompleter
+def build_prefix_index(names):
+    """Returns a (sorted lowercase keys, names in the same order) pair for prefix lookups."""
+    ordered = sorted(names, key=str.lower)
+    return [name.lower() for name in ordered], ordered
+
+def prefix_matches(index, prefix, limit=100):
+    """Returns up to limit names from a prefix index starting with prefix (case-insensitive)."""
+    keys, names = index
+    prefix = prefix.lower()
+    matches = []
+    position = bisect.bisect_left(keys, prefix)
+    while position < len(keys) and keys[position].startswith(prefix) and len(matches) < limit:
+        matches.append(names[position])
+        position += 1
+    return matches
+
+def update_completer(tables):
+    """
+    Rebuilds the completion index from the tables returned by get_schema_tables().
 
+    Only table names are indexed up front; the column index of a table is built
+    the first time completion needs it, so large schemas cost little to load.
+    """
+    global completion_index
+    completion_index = {
+        'tables': tables,
+        'table_index': build_prefix_index(tables),
+        'table_names': {table.lower(): table for table in tables},
+        'keyword_index': build_prefix_index(sql_keywords),
+        'column_indexes': {},
+    }
 
-def launch():
-    schema = None
-    conn = None
-    cur = None
-    model = None
-    chat_history = []
-    completer_needs_update = True
-    syntax_highlighting_enabled = False  # Flag for syntax highlighting
+def column_index(index, table):
+    """Returns the (lazily built) column prefix index of a table."""
+    columns = index['column_indexes'].get(table)
+    if columns is None:
+        columns = build_prefix_index([column[0] for column in index['tables'].get(table, [])])
+        index['column_indexes'][table] = columns
+    return columns
 
-    # Set up command-line arguments
-    parser = argparse.ArgumentParser(description='A Smarter Modern MySQL client')
-    parser.add_argument('--port', help='MySQL port', type=int, default=3306)
-    parser.add_argument('-u', '--user', help='MySQL username')
-    parser.add_argument('-p', '--password', help='MySQL password')
-    parser.add_argument('-H', '--host', help='MySQL host')
-    parser.add_argument('-d', '--database', help='Default database')
-    parser.add_argument('-g', '--gemini_api_key', help='Gemini API key')
-    parser.add_argument('-s', '--syntax-highlighting', action='store_true', help='Enable syntax highlighting')
-    parser.add_argument('--no-password', action='store_true', help='Do not use a password even if it is in env variables')
+TABLE_REFERENCE_RE = re.compile(
+    r"\b(?:FROM|JOIN|UPDATE|INTO)\s+`?([\w$]+)`?(?:\s+(?:AS\s+)?`?([\w$]+)`?)?"
+    r"|,\s*`?([\w$]+)`?(?:\s+(?:AS\s+)?`?([\w$]+)`?)?", re.IGNORECASE)
 
-    args = parser.parse_args()
+def statement_tables(statement, index):
+    """
+    Finds the tables referenced by a statement.
 
-    # Override environment variables with command-line arguments
-    if args.user:
-        db_config['user'] = args.user
-    if args.password:
-        db_config['password'] = args.password
-    if args.host:
-        db_config['host'] = args.host
-    if args.database:
-        db_config['database'] = args.database
-    if args.port:
-        db_config['port'] = args.port
-    if args.no_password and 'password' in db_config:
-        del db_config['password']
-    if args.gemini_api_key:
-        global gemini_api_key
-        gemini_api_key = args.gemini_api_key
+    Returns:
+        A dict mapping lowercase alias and table names to the table name.
+    """
+    references = {}
+    for match in TABLE_REFERENCE_RE.finditer(statement):
+        table_word = match.group(1) or match.group(3)
+        alias = match.group(2) or match.group(4)
+        table = index['table_names'].get(table_word.lower())
+        if table is None:
+            continue
+        references[table.lower()] = table
+        if alias and alias.upper() not in sql_keywords and alias.upper() not in ("INNER", "LEFT", "RIGHT", "CROSS", "USING"):
+            references[alias.lower()] = table
+    return references
+
+def sql_completions(text_before_cursor, text=None, limit=100):
+    """
+    Computes completions for the word at the cursor.
+
+    After FROM/JOIN-like keywords only tables are offered; "alias." offers the
+    columns of the aliased table; elsewhere the columns of the tables used in
+    the statement come first, then keywords and table names.
+
+    Args:
+        text_before_cursor: The input up to the cursor.
+        text: The whole input, used to resolve aliases defined after the cursor.
+
+    Returns:
+        A list of (completion, start_position) pairs.
+    """
+    index = completion_index
+    statement = text_before_cursor.rsplit(";", 1)[-1]
+    word = re.search(r"[\w$.`]*$", statement).group(0)
+    if index is None:
+        return [(keyword, -len(word)) for keyword in prefix_matches(build_prefix_index(sql_keywords), word, limit)]
+
+    full_statement = statement
+    if text:
+        statement_end = text.find(";", len(text_before_cursor))
+        full_statement = text[len(text_before_cursor) - len(statement):statement_end if statement_end != -1 else len(text)]
+    references = statement_tables(full_statement, index)
+
+    if "." in word:
+        qualifier, partial = word.rsplit(".", 1)
+        table = references.get(qualifier.strip("`").lower()) or index['table_names'].get(qualifier.strip("`").lower())
+        if table is None:
+            return []
+        return [(column, -len(partial)) for column in prefix_matches(column_index(index, table), partial.strip("`"), limit)]
+
+    partial = word.strip("`")
+    previous = re.findall(r"[\w$]+|,", statement[:len(statement) - len(word)])
+    if previous and previous[-1].upper() in table_context_keywords:
+        return [(table, -len(word)) for table in prefix_matches(index['table_index'], partial, limit)]
+
+    completions = []
+    for table in dict.fromkeys(references.values()):
+        completions += prefix_matches(column_index(index, table), partial, limit)
+    completions += prefix_matches(index['keyword_index'], partial, limit)
+    completions += prefix_matches(index['table_index'], partial, limit)
+    return [(completion, -len(word)) for completion in list(dict.fromkeys(completions))[:limit]]
+
+def run_statement(conn, cur, sql):
+    """
+    Executes a statement on the connection and prints its results.
+
+    The time spent in each phase (server execute, fetch, converting rows to
+    text and rendering) is recorded for \\stats.
+
+    Returns:
+        A (row_count, execution_time) tuple, where row_count is the number of
+        rows returned or affected.
+    """
+    timings = dict.fromkeys(timing_phases, 0.0)
+    if client_settings['stream']:
+        stream_cur = conn.cursor()  # Unbuffered tuple cursor
+        try:
+            start_time = time.time()
+            stream_cur.execute(sql)
+            execution_time = time.time() - start_time
+            timings['execute'] = execution_time
+
+            if stream_cur.description:
+                columns = [desc[0] for desc in stream_cur.description]
+                batches = fetch_batches(stream_cur, client_settings['stream_batch_rows'], timings)
+                row_count = print_streamed_results(columns, capture_batches(sql, columns, batches), timings=timings)
+                print(f"{row_count} rows returnned ({execution_time:.3f} sec)")
+            else:
+                row_count = stream_cur.rowcount
+                print(f"{row_count} rows affected ({execution_time:.3f} sec)")
+        finally:
+            stream_cur.close()
+        record_statement_timing(sql, timings, row_count)
+        return row_count, execution_time
+
+    start_time = time.time()
+    cur.execute(sql)
+    rows_affected = cur.rowcount  # This is the key change
+    end_time = time.time()
+    execution_time = end_time - start_time
+    timings['execute'] = execution_time
+
+    try:
+        fetch_start = time.time()
+        results = cur.fetchall()
+        convert_start = time.time()
+        lines = format_result_lines(cur, results)
+        render_start = time.time()
+        if lines:
+            print("\n".join(lines))
+        timings['fetch'] = convert_start - fetch_start
+        timings['convert'] = render_start - convert_start
+        timings['render'] = time.time() - render_start
+
+        if cur.description:
+            columns = [desc[0] for desc in cur.description]
+            remember_result(sql, columns, [[row[column] for row in results] for column in columns])
+
+        row_count = len(results)
+        if rows_affected > 0:
+            print(f"{rows_affected} rows affected ({execution_time:.3f} sec)")
+            row_count = rows_affected
+        else:
+            print(f"{row_count} rows returnned ({execution_time:.3f} sec)")
+    except mysql.connector.errors.ProgrammingError:
+        print(f"Error: {rows_affected} rows affected.")  # Show affected rows
+        row_count = rows_affected
+    record_statement_timing(sql, timings, row_count)
+    return row_count, execution_time
+
+def compact_column(values):
+    """Stores a column of ints or floats without NULLs in an array.array; anything else stays a list."""
+    kinds = set(map(type, values))
+    typecode = 'q' if kinds == {int} else 'd' if kinds == {float} else None
+    if typecode:
+        try:
+            return array.array(typecode, values)
+        except OverflowError:
+            pass  # BIGINT UNSIGNED values above 2**63
+    return values
+
+def column_size(values):
+    """Estimates the bytes used by a column, sampling the values of list columns."""
+    if isinstance(values, array.array):
+        return values.itemsize * len(values)
+    sample = values[:100]
+    per_value = sum(sys.getsizeof(value) for value in sample) / len(sample) if sample else 0
+    return sys.getsizeof(values) + int(per_value * len(values))
+
+def remember_result(sql, columns, data):
+    """
+    Keeps a result set for \\last as one array or list per column (no per-row
+    objects). The oldest results are evicted beyond last_results entries or
+    last_results_mb megabytes; a result bigger than the cap is not kept.
+
+    Args:
+        sql: The statement that produced the result.
+        columns: The column names.
+        data: One list of values per column.
+    """
+    cap = client_settings['last_results_mb'] * 1048576
+    if client_settings['last_results'] <= 0:
+        return
+    data = [compact_column(values) for values in data]
+    size = sum(column_size(values) for values in data)
+    if size > cap:
+        return
+    last_results.appendleft({'sql': sql, 'columns': columns, 'data': data,
+                             'rows': len(data[0]) if data else 0, 'size': size})
+    while len(last_results) > client_settings['last_results'] or sum(result['size'] for result in last_results) > cap:
+        last_results.pop()
+
+def capture_batches(sql, columns, batches):
+    """
+    Passes streamed batches through while collecting them for remember_result().
+    Collection stops once the estimated size passes last_results_mb.
+    """
+    data = [[] for _column in columns]
+    cap = client_settings['last_results_mb'] * 1048576
+    row_size = None
+    for batch in batches:
+        if data is not None and batch:
+            for values, column in zip(data, zip(*batch)):
+                values.extend(column)
+            if row_size is None:
+                row_size = sum(column_size(values) for values in data) / len(data[0])
+            if row_size * len(data[0]) > cap:
+                data = None  # Too big to keep, stream on with flat memory
+        yield batch
+    if data is not None:
+        remember_result(sql, columns, data)
+
+LAST_CLAUSE_RE = re.compile(r"\s*(where|sort|head)\s+", re.IGNORECASE)
+LAST_CONDITION_RE = re.compile(r"""
+    \s*(?P<column>`[^`]+`|\w+)\s*
+    (?:(?P<null>IS\s+(?:NOT\s+)?NULL)\b
+      |(?P<op>>=|<=|!=|<>|=|>|<|NOT\s+LIKE\b|LIKE\b)\s*(?P<value>'(?:[^']|'')*'|"[^"]*"|\S+))
+""", re.VERBOSE | re.IGNORECASE)
+
+comparison_operators = {
+    "=": lambda a, b: a == b, "!=": lambda a, b: a != b, "<>": lambda a, b: a != b,
+    ">": lambda a, b: a > b, ">=": lambda a, b: a >= b, "<": lambda a, b: a < b, "<=": lambda a, b: a <= b,
+}
+
+def last_condition(null, op, value):
+    """Returns a test for one \\last where condition, comparing like MySQL (numbers numerically, text case-insensitively)."""
+    if null:
+        is_not = "NOT" in null.upper()
+        return lambda v: (v is not None) == is_not
+    if value[:1] in ("'", '"'):
+        value = value[1:-1].replace(value[0] * 2, value[0])
+    op = " ".join(op.upper().split())
+    if op.endswith("LIKE"):
+        pattern = re.compile("".join(".*" if c == "%" else "." if c == "_" else re.escape(c) for c in value),
+                             re.IGNORECASE | re.DOTALL)
+        wanted = op == "LIKE"
+        return lambda v: v is not None and bool(pattern.fullmatch(str(v))) == wanted
+    try:
+        number = decimal.Decimal(value)
+    except decimal.InvalidOperation:
+        number = None
+    compare = comparison_operators[op]
+    text = value.lower()
+
+    def test(v):
+        if v is None:
+            return False
+        if number is not None and isinstance(v, (int, float, decimal.Decimal)) and not isinstance(v, bool):
+            return compare(v, number)
+        return compare(str(v).lower(), text)
+    return test
+
+def last_sort_key(value):
+    """
+    Returns a \\last sort key that orders any mix of types: NULLs first, then
+    numbers by value, then everything else as case-insensitive text, like
+    the where clause compares it.
+    """
+    if value is None:
+        return (0, 0)
+    if isinstance(value, (int, float, decimal.Decimal)) and not isinstance(value, bool):
+        return (1, value)
+    return (2, str(value).lower())
+
+def select_last_rows(result, arg):
+    """
+    Applies \\last clauses in the order given: "where <condition> [and ...]",
+    "sort <column> [asc|desc]" and "head <n>".
+
+    Returns:
+        The selected row numbers.
+
+    Raises:
+        ValueError: For an unknown clause or column.
+    """
+    columns = {name.lower(): values for name, values in zip(result['columns'], result['data'])}
+
+    def column_values(name):
+        values = columns.get(name.strip("`").lower())
+        if values is None:
+            raise ValueError(f"Unknown column: {name} (columns: {', '.join(result['columns'])})")
+        return values
+
+    rows = range(result['rows'])
+    pos = 0
+    while arg[pos:].strip():
+        match = LAST_CLAUSE_RE.match(arg, pos)
+        if not match:
+            raise ValueError(f"Expected where, sort or head at: {arg[pos:].strip()}")
+        keyword, pos = match.group(1).lower(), match.end()
+        if keyword == "head":
+            match = re.compile(r"(\d+)\b").match(arg, pos)
+            if not match:
+                raise ValueError("head needs a row count")
+            rows = rows[:int(match.group(1))]
+        elif keyword == "sort":
+            match = re.compile(r"(`[^`]+`|\w+)(?:\s+(asc|desc)\b)?", re.IGNORECASE).match(arg, pos)
+            if not match:
+                raise ValueError("sort needs a column")
+            values = column_values(match.group(1))
+            rows = sorted(rows, key=lambda i: last_sort_key(values[i]),
+                          reverse=(match.group(2) or "").lower() == "desc")
+        else:
+            while True:
+                match = LAST_CONDITION_RE.match(arg, pos)
+                if not match:
+                    raise ValueError(f"Invalid condition: {arg[pos:].strip()}")
+                values = column_values(match.group('column'))
+                test = last_condition(match.group('null'), match.group('op'), match.group('value'))
+                rows = [i for i in rows if test(values[i])]
+                pos = match.end()
+                conjunction = re.compile(r"\s+AND\s+", re.IGNORECASE).match(arg, pos)
+                if not conjunction:
+                    break
+                pos = conjunction.end()
+        pos = match.end()
+    return rows
+
+def statement_digest(sql):
+    """Normalizes a statement into a digest: literals become ?, value lists collapse, case and spacing are folded."""
+    digest = re.sub(r"'(?:[^'\\]|\\.|'')*'|\"(?:[^\"\\]|\\.|\"\")*\"", "?", sql)
+    digest = re.sub(r"\b0x[0-9a-fA-F]+\b|(?<![\w.])-?\d+(?:\.\d+)?(?:[eE][-+]?\d+)?\b", "?", digest)
+    digest = re.sub(r"\(\s*\?(?:\s*,\s*\?)*\s*\)(?:\s*,\s*\(\s*\?(?:\s*,\s*\?)*\s*\))*", "(...)", digest)
+    return " ".join(digest.lower().split())
+
+def record_statement_timing(sql, timings, row_count):
+    """Records a statement's phase timings for \\stats, printing them if \\timing is on."""
+    total = sum(timings.values())
+    digest = statement_digest(sql)
+    statement_timings.append(dict(timings, digest=digest, total=total, rows=row_count, timestamp=time.time()))
+    digest_latencies.setdefault(digest, []).append(total)
+    if client_settings['show_timing']:
+        print(" (" + ", ".join(f"{phase} {timings[phase]:.3f}" for phase in timing_phases) + f", total {total:.3f} sec)")
+
+def percentile(sorted_values, pct):
+    """Returns the nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    rank = max(math.ceil(pct / 100 * len(sorted_values)), 1)
+    return sorted_values[rank - 1]
+
+def digest_statistics():
+    """
+    Summarizes the session's latencies per statement digest.
+
+    Returns:
+        A list of dicts (digest, count, total, p50, p95, p99, max), slowest total first.
+    """
+    stats = []
+    for digest, latencies in digest_latencies.items():
+        ordered = sorted(latencies)
+        stats.append({
+            'digest': digest, 'count': len(ordered), 'total': sum(ordered),
+            'p50': percentile(ordered, 50), 'p95': percentile(ordered, 95),
+            'p99': percentile(ordered, 99), 'max': ordered[-1],
+        })
+    stats.sort(key=lambda stat: stat['total'], reverse=True)
+    return stats
+
+def export_format(path):
+    """
+    Returns the export format for path, or None (after printing why) if it cannot be written.
+    """
+    fmt = export_formats.get(os.path.splitext(path)[1].lower())
+    if fmt is None:
+        print(f"Unsupported export format: {path} (use {', '.join(export_formats)})")
+        return None
+    if fmt == 'parquet':
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            print("Parquet export needs pyarrow (pip install pyarrow)")
+            return None
+    return fmt
+
+def parquet_schema(description):
+    """Maps a cursor description to a pyarrow schema."""
+    import pyarrow as pa
+    from mysql.connector import FieldType, FieldFlag
+
+    fields = []
+    for desc in description:
+        type_code = desc[1]
+        flags = desc[7] if len(desc) > 7 and desc[7] else 0
+        if type_code in (FieldType.TINY, FieldType.SHORT, FieldType.LONG, FieldType.INT24, FieldType.YEAR):
+            arrow_type = pa.int64()
+        elif type_code == FieldType.LONGLONG:
+            arrow_type = pa.uint64() if flags & FieldFlag.UNSIGNED else pa.int64()
+        elif type_code in (FieldType.FLOAT, FieldType.DOUBLE):
+            arrow_type = pa.float64()
+        elif type_code in (FieldType.DATE, FieldType.NEWDATE):
+            arrow_type = pa.date32()
+        elif type_code in (FieldType.DATETIME, FieldType.TIMESTAMP):
+            arrow_type = pa.timestamp('us')
+        elif type_code == FieldType.TIME:
+            arrow_type = pa.duration('us')
+        elif type_code in (FieldType.TINY_BLOB, FieldType.MEDIUM_BLOB, FieldType.LONG_BLOB, FieldType.BLOB,
+                           FieldType.STRING, FieldType.VAR_STRING, FieldType.BIT) and flags & FieldFlag.BINARY:
+            arrow_type = pa.binary()
+        else:
+            arrow_type = pa.string()  # DECIMAL is kept exact as text, as are JSON/SET/ENUM
+        fields.append(pa.field(desc[0], arrow_type))
+    return pa.schema(fields)
+
+def export_results(cursor, path, fmt, timings=None):
+    """
+    Streams the cursor's result set into a CSV, JSON Lines or Parquet file.
+
+    Rows are fetched and written in batches of export_batch_rows, so the full
+    result is never held in memory.
+
+    Args:
+        cursor: An unbuffered tuple cursor with a pending result set.
+        path: The output file, replaced if it exists.
+        fmt: One of the values of export_formats.
+        timings: Optional dict whose 'fetch' entry is increased.
+
+    Returns:
+        The number of rows written.
+    """
+    columns = [desc[0] for desc in cursor.description]
+    batches = fetch_batches(cursor, client_settings['export_batch_rows'], timings)
+    row_count = 0
+
+    if fmt == 'csv':
+        with open(path, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(columns)
+            for batch in batches:
+                writer.writerows(batch)
+                row_count += len(batch)
+
+    elif fmt == 'jsonl':
+        with open(path, 'w') as f:
+            for batch in batches:
+                f.write("".join(json.dumps(dict(zip(columns, row)), default=str) + "\n" for row in batch))
+                row_count += len(batch)
+
+    elif fmt == 'parquet':
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        schema = parquet_schema(cursor.description)
+        text_columns = [i for i, field in enumerate(schema) if field.type == pa.string()]
+        with pq.ParquetWriter(path, schema) as writer:
+            for batch in batches:
+                values = [list(column) for column in zip(*batch)]
+                for i in text_columns:
+                    values[i] = [str(v) if v is not None and not isinstance(v, str) else v for v in values[i]]
+                writer.write_table(pa.Table.from_arrays(
+                    [pa.array(column, type=field.type) for column, field in zip(values, schema)], schema=schema))
+                row_count += len(batch)
+
+    return row_count
+
+def export_statement(conn, sql, path, fmt):
+    """
+    Executes a statement on a tuple cursor and exports its result set to path.
+
+    Returns:
+        A (row_count, execution_time) tuple.
+    """
+    timings = dict.fromkeys(timing_phases, 0.0)
+    export_cur = conn.cursor()  # Unbuffered, no per-row dicts
+    try:
+        start_time = time.time()
+        export_cur.execute(sql)
+        execution_time = time.time() - start_time
+        timings['execute'] = execution_time
+        if not export_cur.description:
+            print(f"{export_cur.rowcount} rows affected ({execution_time:.3f} sec)")
+            record_statement_timing(sql, timings, export_cur.rowcount)
+            return export_cur.rowcount, execution_time
+
+        row_count = export_results(export_cur, path, fmt, timings)
+        total_time = time.time() - start_time
+        timings['render'] = total_time - execution_time - timings['fetch']  # Converting and writing the file
+        print(f"{row_count} rows written to {path} ({total_time:.3f} sec, {row_count / max(total_time, 1e-6):,.0f} rows/sec)")
+        record_statement_timing(sql, timings, row_count)
+        return row_count, execution_time
+    finally:
+        export_cur.close()
+
+def split_into_local(sql):
+    """
+    Splits a trailing INTO LOCAL 'file' clause off a statement.
+
+    Returns:
+        A (sql, path) tuple; path is None when there is no such clause.
+    """
+    match = re.search(r"\s+INTO\s+LOCAL\s+(['\"])(.+?)\1\s*;?\s*$", sql, re.IGNORECASE)
+    if not match:
+        return sql, None
+    return sql[:match.start()], os.path.expanduser(match.group(2))
+
+def plan_tables(plan):
+    """
+    Collects the table access nodes of an EXPLAIN FORMAT=JSON plan (MySQL or MariaDB).
+
+    Returns:
+        A list of (table node, join buffered, join position) tuples in plan order,
+        and a set of plan-wide flags ('filesort', 'temporary').
+    """
+    nodes = []
+    flags = set()
+
+    def walk(value, buffered=False):
+        if isinstance(value, list):
+            for item in value:
+                walk(item, buffered)
+            return
+        if not isinstance(value, dict):
+            return
+        if value.get('using_filesort') or 'filesort' in value:
+            flags.add('filesort')
+        if value.get('using_temporary_table') or 'temporary_table' in value:
+            flags.add('temporary')
+        for key, child in value.items():
+            if key == 'table' and isinstance(child, dict) and 'table_name' in child:
+                # MariaDB attaches the join condition to the block-nl-join, not its table
+                if buffered and 'attached_condition' in value and 'attached_condition' not in child:
+                    child = {**child, 'attached_condition': value['attached_condition']}
+                nodes.append((child, buffered or bool(child.get('using_join_buffer')), len(nodes)))
+                walk({k: v for k, v in child.items() if isinstance(v, (dict, list))})
+            else:
+                walk(child, buffered or key == 'block-nl-join')
+
+    walk(plan)
+    return nodes, flags
+
+def condition_columns(condition, table_alias):
+    """
+    Finds the columns of table_alias used in an attached condition.
+
+    Returns:
+        A (equality columns, range columns) pair of lists.
+    """
+    column_re = rf"(?<![\w$])`?{re.escape(table_alias)}`?\.`?([\w$]+)`?"
+    equality = re.findall(column_re + r"\s*=(?!=)", condition)
+    equality += re.findall(r"(?<![<>!])=\s*" + column_re, condition)
+    equality += re.findall(column_re + r"\s+in\s*\(", condition, re.IGNORECASE)
+    ranges = re.findall(column_re + r"\s*(?:<|>|<=|>=|\s+between\s|\s+like\s+'[^%_])", condition, re.IGNORECASE)
+    equality = list(dict.fromkeys(equality))
+    return equality, [column for column in dict.fromkeys(ranges) if column not in equality]
+
+def analyze_plan(plan, tables=None, sql=""):
+    """
+    Looks for common problems in an EXPLAIN FORMAT=JSON plan.
+
+    Flags full table/index scans, filesorts, temporary tables, tables joined
+    without a usable index (join buffer / scans inside the join) and row
+    estimates above explain_row_warning, and suggests indexes from the columns
+    in each table's attached condition. Runs locally, no server access.
+
+    Args:
+        plan: The parsed JSON plan.
+        tables: Optional schema from get_schema_tables(), used to resolve aliases
+            and check suggested columns.
+        sql: The explained statement, used to resolve table aliases.
+
+    Returns:
+        A (rows, warnings, suggestions) tuple: one summary row per table, and
+        lists of warning and suggestion strings.
+    """
+    tables = tables or {}
+    aliases = {}
+    if sql and tables:
+        aliases = statement_tables(sql, {'table_names': {table.lower(): table for table in tables}})
+    row_warning = client_settings['explain_row_warning']
+
+    nodes, flags = plan_tables(plan)
+    rows, warnings, suggestions = [], [], []
+    for node, buffered, position in nodes:
+        alias = node['table_name']
+        table = aliases.get(alias.lower(), alias)
+        access_type = node.get('access_type', '')
+        estimate = node.get('rows_examined_per_scan', node.get('rows', 0)) or 0
+        produced = node.get('rows_produced_per_join', estimate) or 0
+        rows.append((alias, access_type, node.get('key'), estimate, node.get('filtered')))
+
+        if access_type == 'ALL':
+            warnings.append(f"Full table scan on {alias} (~{estimate:,} rows)")
+        elif access_type == 'index':
+            warnings.append(f"Full index scan on {alias} using {node.get('key')} (~{estimate:,} rows)")
+        if node.get('possible_keys') and not node.get('key'):
+            warnings.append(f"{alias}: possible keys {', '.join(node['possible_keys'])} are not used")
+        if position > 0 and (buffered or access_type in ('ALL', 'index')):
+            warnings.append(f"Join order: {alias} is joined without a usable index and is scanned for rows of the earlier tables")
+        if max(estimate, produced) > row_warning:
+            warnings.append(f"Large row estimate for {alias}: {estimate:,} examined per scan, {produced:,} produced by the join")
+
+        if access_type in ('ALL', 'index', 'range') or buffered:
+            equality, ranges = condition_columns(node.get('attached_condition', ''), alias)
+            known = {column[0]: column for column in tables.get(table, [])}
+            if known:
+                equality = [column for column in equality if column in known]
+                ranges = [column for column in ranges if column in known]
+            index_columns = equality + ranges[:1]
+            if index_columns and not (len(index_columns) == 1 and known.get(index_columns[0], [None, None, ''])[2] in ('PRI', 'UNI')):
+                index_name = "idx_" + "_".join([table] + index_columns)[:60]
+                suggestions.append(f"ALTER TABLE `{table}` ADD INDEX `{index_name}` ({', '.join(f'`{c}`' for c in index_columns)})")
+
+    if 'filesort' in flags:
+        warnings.append("Using filesort (ORDER BY/GROUP BY cannot use an index)")
+    if 'temporary' in flags:
+        warnings.append("Using a temporary table")
+    return rows, warnings, list(dict.fromkeys(suggestions))
+
+def explain_statement(conn, sql):
+    """Runs EXPLAIN FORMAT=JSON for sql and prints the plan summary, warnings and index suggestions."""
+    explain_cur = conn.cursor()
+    try:
+        explain_cur.execute(f"EXPLAIN FORMAT=JSON {sql}")
+        plan = json.loads(explain_cur.fetchall()[0][0])
+    finally:
+        explain_cur.close()
+
+    rows, warnings, suggestions = analyze_plan(plan, schema_snapshot[1], sql)
+    cost = plan.get('query_block', {}).get('cost_info', {}).get('query_cost')
+    print(f" -- Plan{f' (cost {cost})' if cost else ''}:")
+    for table, access_type, key, estimate, filtered in rows:
+        print(f"    {table:<24} {access_type:<12} key={key or '-':<24} rows={estimate:<12} filtered={filtered if filtered is not None else '-'}")
+    for warning in warnings:
+        print(f"    ! {warning}")
+    for suggestion in suggestions:
+        print(f"    + Consider: {suggestion}")
+    if not warnings:
+        print("    No problems found.")
+
+# Counters of performance_schema.events_statements_summary_by_digest diffed by \digests
+DIGEST_COUNTERS_SQL = """
+SELECT SCHEMA_NAME, DIGEST, COUNT_STAR, SUM_TIMER_WAIT, SUM_ROWS_EXAMINED,
+       SUM_CREATED_TMP_DISK_TABLES, SUM_NO_INDEX_USED + SUM_NO_GOOD_INDEX_USED
+FROM performance_schema.events_statements_summary_by_digest
+WHERE DIGEST IS NOT NULL
+"""
+
+# \digests ranking name -> position of the counter in a diff entry
+digest_rankings = {'latency': 1, 'rows': 2, 'tmpdisk': 3, 'noindex': 4}
+
+def digest_snapshot(cur):
+    """Returns {(schema, digest): (calls, timer wait, rows examined, tmp disk tables, no index used)}."""
+    cur.execute(DIGEST_COUNTERS_SQL)
+    return {(row[0], row[1]): tuple(int(value or 0) for value in row[2:]) for row in cur.fetchall()}
+
+def diff_digest_snapshots(before, after):
+    """
+    Returns the counter increase of every digest that ran between two snapshots.
+
+    A digest whose counters went down was evicted and re-added (or the table
+    was truncated) in between, so its current counters are the increase.
+    """
+    diff = {}
+    for key, counters in after.items():
+        previous = before.get(key)
+        if previous is not None and counters[0] >= previous[0]:
+            counters = tuple(now - then for now, then in zip(counters, previous))
+        if counters[0] > 0:
+            diff[key] = counters
+    return diff
+
+def top_digests(conn, interval, ranking, limit=10):
+    """
+    Snapshots the statement digest summary twice, interval seconds apart,
+    and prints the digests that did the most work in between.
+
+    Only the numeric counters are read for the snapshots; the digest and
+    sample texts are fetched afterwards for the listed digests only. The
+    listing is kept in last_digests for \\explain #N.
+
+    Args:
+        conn: The connection to read performance_schema on.
+        interval: Seconds between the snapshots.
+        ranking: One of digest_rankings.
+        limit: Number of digests listed.
+    """
+    global last_digests
+    digest_cur = conn.cursor()
+    try:
+        before = digest_snapshot(digest_cur)
+        print(f"Sampling statement digests for {interval:g} sec (Ctrl-C to stop early)...")
+        started = time.time()
+        try:
+            time.sleep(interval)
+        except KeyboardInterrupt:
+            pass
+        after = digest_snapshot(digest_cur)
+        elapsed = time.time() - started
+
+        position = digest_rankings[ranking]
+        diff = diff_digest_snapshots(before, after)
+        top = sorted(diff.items(), key=lambda item: item[1][position], reverse=True)[:limit]
+        if not top:
+            print("No statements ran in that window.")
+            return
+
+        texts = {}
+        conditions = " OR ".join(["(SCHEMA_NAME <=> %s AND DIGEST = %s)"] * len(top))
+        params = tuple(value for key, _counters in top for value in key)
+        try:
+            digest_cur.execute("SELECT SCHEMA_NAME, DIGEST, DIGEST_TEXT, QUERY_SAMPLE_TEXT "
+                               f"FROM performance_schema.events_statements_summary_by_digest WHERE {conditions}", params)
+        except mysql.connector.Error:  # No QUERY_SAMPLE_TEXT before MySQL 8.0.3 and on MariaDB
+            digest_cur.execute("SELECT SCHEMA_NAME, DIGEST, DIGEST_TEXT, NULL "
+                               f"FROM performance_schema.events_statements_summary_by_digest WHERE {conditions}", params)
+        for schema, digest, digest_text, sample in digest_cur.fetchall():
+            texts[(schema, digest)] = (digest_text, sample)
+    finally:
+        digest_cur.close()
+
+    print(f"Top digests by {ranking} over {elapsed:.1f} sec ({len(diff)} of {len(after)} digests active):")
+    print(f"{'#':>3} {'calls':>8} {'calls/s':>8} {'total ms':>10} {'avg ms':>8} {'rows exam':>10} {'tmp disk':>8} {'no idx':>7}  statement")
+    last_digests = []
+    for number, (key, (calls, wait, rows_examined, tmp_disk, no_index)) in enumerate(top, 1):
+        digest_text, sample = texts.get(key, (None, None))
+        last_digests.append({'schema': key[0], 'digest_text': digest_text, 'sample': sample})
+        total_ms = wait / 1e9  # Timers are in picoseconds
+        print(f"{number:>3} {calls:>8} {calls / elapsed:>8.1f} {total_ms:>10.1f} {total_ms / calls:>8.2f} "
+              f"{rows_examined:>10} {tmp_disk:>8} {no_index:>7}  "
+              f"{f'[{key[0]}] ' if key[0] else ''}{' '.join((digest_text or key[1]).split())[:100]}")
+    print("Use \\explain #N to explain a digest's sample statement")
+
+def kill_query(connection_id, whole_connection=False):
+    """
+    Issues KILL QUERY (or KILL, with whole_connection) for connection_id from
+    the control connection.
+
+    Returns:
+        True if the server accepted the KILL.
+    """
+    global control_conn
+    try:
+        if control_conn is None or not control_conn.is_connected():
+            control_conn = open_side_connection()
+        kill_cur = control_conn.cursor()
+        kill_cur.execute(f"KILL {'' if whole_connection else 'QUERY '}{int(connection_id)}")
+        kill_cur.close()
+        return True
+    except mysql.connector.Error as err:
+        print(f"Error cancelling query: {err}")
+        return False
+
+class StatementAbandoned(KeyboardInterrupt):
+    """Raised by run_cancellable() when the user stops waiting for a statement; its connection is unusable."""
+
+def run_cancellable(conn, func, *args):
+    """
+    Runs func(*args) in a worker thread so the statement it runs can be cancelled.
+
+    Ctrl-C, or exceeding client_settings['statement_timeout'], sends KILL QUERY
+    for the connection from a separate control connection; the server then
+    aborts the statement and the session stays usable. A second Ctrl-C gives up
+    waiting: the whole connection is killed if the control connection can
+    still reach the server, and StatementAbandoned is raised so the caller
+    replaces the connection.
+
+    Args:
+        conn: The connection the statement runs on.
+        func: The function executing the statement.
+
+    Returns:
+        func's return value, or None if the statement was cancelled.
+
+    Raises:
+        StatementAbandoned: After the second Ctrl-C.
+    """
+    outcome = {}
+    finished = threading.Event()  # Not Thread.join(): a Ctrl-C inside join() can make is_alive() lie
+
+    def target():
+        try:
+            outcome['result'] = func(*args)
+        except BaseException as e:
+            outcome['error'] = e
+        finally:
+            finished.set()
+
+    connection_id = conn.connection_id
+    timeout = client_settings['statement_timeout']
+    cancel_reason = None
+    interrupted = False
+    start_time = time.time()
+    worker = threading.Thread(target=target, daemon=True)
+    worker.start()
+    while not finished.is_set():
+        try:
+            finished.wait(0.1)
+            if timeout and cancel_reason is None and time.time() - start_time > timeout:
+                cancel_reason = f"timeout of {timeout} sec"
+                kill_query(connection_id)
+        except KeyboardInterrupt:
+            if interrupted:
+                print("\nGiving up on the query and its connection...")
+                if kill_query(connection_id, whole_connection=True):
+                    try:
+                        finished.wait(2)  # The killed connection fails the worker's read
+                    except KeyboardInterrupt:
+                        pass
+                raise StatementAbandoned()
+            interrupted = True
+            cancel_reason = "Ctrl-C"
+            print("\nCancelling query (Ctrl-C again to stop waiting)...")
+            kill_query(connection_id)
+
+    error = outcome.get('error')
+    if cancel_reason is not None:
+        print(f"Query cancelled ({cancel_reason}) after {time.time() - start_time:.3f} sec")
+        if error is None or (isinstance(error, mysql.connector.Error) and error.errno == mysql.connector.errorcode.ER_QUERY_INTERRUPTED):
+            return None
+    if error is not None:
+        raise error
+    return outcome.get('result')
+
+SQL_TOKEN_RE = re.compile(r"""
+    (?P<quoted>'(?:[^'\\]|\\.|'')*'|"(?:[^"\\]|\\.|"")*"|`(?:[^`]|``)*`)
+  | (?P<comment>(?:--(?=\s|$)|\#)[^\n]*)
+  | (?P<block>/\*.*?\*/)
+  | (?P<delimiter_command>^[ \t]*DELIMITER[ \t]+(?P<delimiter>\S+)[^\n]*)
+""", re.VERBOSE | re.DOTALL | re.MULTILINE | re.IGNORECASE)
+
+def split_sql_statements(text):
+    """
+    Splits a SQL script into statements.
+
+    Delimiters inside quoted strings, identifiers and comments are ignored, and
+    the mysql client's DELIMITER command is honoured. Line comments are dropped;
+    block comments are kept since they may be executable (/*! ... */).
+
+    Args:
+        text: The script.
+
+    Returns:
+        A list of statements without their delimiters.
+    """
+    statements = []
+    delimiter = ";"
+    current = []
+    pos = 0
+    token = SQL_TOKEN_RE.search(text, pos)
+    delimiter_pos = text.find(delimiter, pos)
+
+    def emit():
+        statement = "".join(current).strip()
+        if statement:
+            statements.append(statement)
+        current.clear()
+
+    while pos < len(text):
+        if token is not None and token.start() < pos:
+            token = SQL_TOKEN_RE.search(text, pos)
+        if delimiter_pos != -1 and delimiter_pos < pos:
+            delimiter_pos = text.find(delimiter, pos)
+
+        if delimiter_pos != -1 and (token is None or delimiter_pos < token.start()):
+            current.append(text[pos:delimiter_pos])
+            emit()
+            pos = delimiter_pos + len(delimiter)
+            continue
+        if token is None:
+            current.append(text[pos:])
+            break
+
+        current.append(text[pos:token.start()])
+        pos = token.end()
+        if token.group('delimiter_command'):
+            emit()
+            delimiter = token.group('delimiter')
+            delimiter_pos = text.find(delimiter, pos)
+        elif not token.group('comment'):
+            current.append(token.group(0))
+    emit()
+    return statements
+
+def tsv_value(value):
+    """Formats a value the way the mysql client does in batch mode."""
+    if value is None:
+        return "NULL"
+    return str(value).replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n")
+
+def run_batch(statements, parallel=1, force=False, timing_file=None):
+    """
+    Runs statements without the interactive prompt, schema loading or banner.
+
+    Results are written to stdout as tab-separated rows, and one JSON line per
+    statement (index, seconds, rows, error) is written to timing_file. With
+    parallel > 1 the statements are spread over that many connections, so they
+    must be independent of each other.
+
+    Args:
+        statements: The statements to run, in order.
+        parallel: Number of worker connections.
+        force: Keep going after a failed statement.
+        timing_file: Where the timing records go (default stderr).
+
+    Returns:
+        The number of failed statements.
+    """
+    timing_file = timing_file or sys.stderr
+    work = queue.Queue()
+    for index, statement in enumerate(statements, 1):
+        work.put((index, statement))
+    output_lock = threading.Lock()
+    stop = threading.Event()
+    failures = []
+
+    def worker(worker_id):
+        try:
+            worker_conn = mysql.connector.connect(**db_config)
+        except mysql.connector.Error as err:
+            print(f"Error connecting to MySQL Platform: {err}", file=sys.stderr)
+            failures.append(None)
+            stop.set()
+            return
+        worker_conn.autocommit = True
+        worker_cur = worker_conn.cursor()
+        try:
+            while not stop.is_set():
+                try:
+                    index, statement = work.get_nowait()
+                except queue.Empty:
+                    break
+                # A single worker streams straight to stdout, parallel ones buffer each result
+                out = io.StringIO() if parallel > 1 else sys.stdout
+                row_count, error = 0, None
+                start_time = time.time()
+                try:
+                    worker_cur.execute(statement)
+                    if worker_cur.description:
+                        out.write("\t".join(desc[0] for desc in worker_cur.description) + "\n")
+                        for batch in fetch_batches(worker_cur, client_settings['export_batch_rows']):
+                            out.write("".join("\t".join(tsv_value(v) for v in row) + "\n" for row in batch))
+                            row_count += len(batch)
+                    else:
+                        row_count = worker_cur.rowcount
+                except mysql.connector.Error as err:
+                    error = str(err)
+                elapsed = time.time() - start_time
+
+                with output_lock:
+                    if out is not sys.stdout:
+                        sys.stdout.write(out.getvalue())
+                    if error:
+                        print(f"ERROR at statement {index}: {error}", file=sys.stderr)
+                        failures.append(index)
+                        if not force:
+                            stop.set()
+                    timing_file.write(json.dumps({
+                        "statement": index, "worker": worker_id, "seconds": round(elapsed, 6),
+                        "rows": row_count, "error": error, "sql": statement[:200],
+                    }) + "\n")
+                    timing_file.flush()
+        finally:
+            worker_conn.close()
+
+    workers = [threading.Thread(target=worker, args=(i,)) for i in range(max(parallel, 1))]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    sys.stdout.flush()
+    return len(failures)
+
+LOAD_STATEMENT_RE = re.compile(r"^(?P<path>.+?)\s+INTO\s+(?P<table>[\w$.`]+)\s*;?\s*$", re.IGNORECASE)
+
+# Bytes that are not UTF-8 decode to lone surrogates with errors='surrogateescape'
+INVALID_UTF8_RE = re.compile("[\udc80-\udcff]")
+
+def load_table_columns(cur, table):
+    """
+    Returns [(column, column_type), ...] for table, from the schema snapshot
+    when it is a table of the current database, otherwise from information_schema.
+    """
+    schema, _, name = table.replace("`", "").rpartition(".")
+    _database, tables, _schema_str = schema_snapshot
+    if not schema and name in tables:
+        return [(column, column_type) for column, column_type, _key in tables[name]]
+    cur.execute("""
+        SELECT COLUMN_NAME, COLUMN_TYPE FROM information_schema.COLUMNS
+        WHERE TABLE_SCHEMA = COALESCE(%s, DATABASE()) AND TABLE_NAME = %s
+        ORDER BY ORDINAL_POSITION""", (schema or None, name))
+    return [tuple(row) for row in cur.fetchall()]
+
+def column_converter(column_type):
+    """
+    Returns a function turning a CSV/JSON value into the value inserted into a
+    column of the given MySQL type. \\N becomes NULL in every column, and so
+    do empty values outside text columns (like load_data_local() does);
+    values that do not fit the type raise ValueError.
+    """
+    base = re.match(r"\w+", column_type.lower()).group(0)
+    if base in ("tinyint", "smallint", "mediumint", "int", "integer", "bigint", "year", "bit", "bool", "boolean"):
+        parse = int
+    elif base in ("decimal", "numeric"):
+        parse = lambda value: decimal.Decimal(str(value))
+    elif base in ("float", "double", "real"):
+        parse = float
+    elif base == "json":
+        return lambda value: None if value is None or value == "" or value == "\\N" else (
+            value if isinstance(value, str) else json.dumps(value))
+    else:
+        return lambda value: None if value is None or value == "\\N" else (
+            json.dumps(value) if isinstance(value, (dict, list)) else str(value))
+
+    def convert(value):
+        if value is None or value == "" or value == "\\N":
+            return None
+        try:
+            return parse(value)
+        except (TypeError, ValueError, ArithmeticError):
+            raise ValueError(f"{value!r} is not a valid {base}")
+    return convert
+
+def read_load_records(path, fmt):
+    """
+    Yields (line number, record dict or None, error or None) for every record of a CSV (with a header) or JSONL file.
+    Records that are not valid UTF-8, CSV or JSON come with an error instead of ending the load.
+    """
+    with open(path, newline='', encoding='utf-8', errors='surrogateescape') as f:
+        if fmt == 'csv':
+            reader = csv.DictReader(f)
+            while True:
+                try:
+                    record = next(reader)
+                except StopIteration:
+                    break
+                except csv.Error as err:
+                    yield reader.reader.line_num, None, f"invalid CSV: {err}"  # DictReader.line_num lags on errors
+                    continue
+                if None in record:
+                    yield reader.line_num, None, "more fields than the header"
+                elif any(value and INVALID_UTF8_RE.search(value) for value in record.values()):
+                    yield reader.line_num, None, "not valid UTF-8"
+                else:
+                    yield reader.line_num, record, None
+        else:
+            for line_number, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                if INVALID_UTF8_RE.search(line):
+                    yield line_number, None, "not valid UTF-8"
+                    continue
+                try:
+                    record = json.loads(line)
+                except ValueError as err:
+                    yield line_number, None, f"invalid JSON: {err}"
+                    continue
+                if isinstance(record, dict):
+                    yield line_number, record, None
+                else:
+                    yield line_number, None, "not a JSON object"
+
+def load_data_local(path, table, columns, header, column_types):
+    """
+    Loads a CSV file with LOAD DATA LOCAL INFILE on a connection that allows it.
+
+    The server skips rows with duplicate keys and adjusts values that do not
+    fit their column, raising a warning for each; the first ten are returned.
+
+    Returns:
+        (rows loaded, warning count, ["Level code: message", ...]), or None if
+        the server or client does not allow local infile.
+    """
+    with open(path, 'rb') as f:
+        first_line = f.readline()
+    line_end = "\\r\\n" if first_line.endswith(b"\r\n") else "\\n"
+
+    # NULLs as column_converter() reads them: \N (X'5C4E', whatever the sql_mode) in every
+    # column, and empty fields too outside text columns, rather than 0 or a zero date
+    targets, assignments = [], []
+    for i, column in enumerate(header):
+        if column not in columns:
+            targets.append("@dummy")
+            continue
+        targets.append(f"@v{i}")
+        if re.match(r"(?:var)?char|(?:tiny|medium|long)?text|enum|set|(?:var)?binary|(?:tiny|medium|long)?blob", column_types[column].lower()):
+            assignments.append(f"`{columns[column]}` = NULLIF(@v{i}, X'5C4E')")
+        else:
+            assignments.append(f"`{columns[column]}` = NULLIF(NULLIF(@v{i}, ''), X'5C4E')")
+
+    try:
+        load_conn = mysql.connector.connect(**dict(db_config, allow_local_infile=True))
+    except mysql.connector.Error:
+        return None
+    try:
+        load_cur = load_conn.cursor()
+        load_cur.execute("SELECT @@local_infile")
+        if not int(load_cur.fetchone()[0]):
+            return None
+        load_cur.execute(
+            f"LOAD DATA LOCAL INFILE %s INTO TABLE {table} CHARACTER SET utf8mb4 "
+            f"FIELDS TERMINATED BY ',' OPTIONALLY ENCLOSED BY '\"' ESCAPED BY '' "
+            f"LINES TERMINATED BY '{line_end}' IGNORE 1 LINES ({', '.join(targets)})"
+            + (f" SET {', '.join(assignments)}" if assignments else ""), (path,))
+        loaded, warning_count = load_cur.rowcount, load_cur.warning_count
+        warnings = []
+        if warning_count:
+            load_cur.execute("SHOW WARNINGS LIMIT 10")
+            warnings = [f"{level} {code}: {message}" for level, code, message in load_cur.fetchall()]
+        load_conn.commit()
+        return loaded, warning_count, warnings
+    except mysql.connector.Error as err:
+        if err.errno in (1148, 2068, 3948, 3950):  # Local infile disabled on the server or the client
+            return None
+        raise
+    finally:
+        load_conn.close()
+
+def load_file(cur, path, table):
+    """
+    Loads a CSV (with a header row) or JSONL file into a table, matching
+    fields to columns by name. The loaded fields are those of the CSV header,
+    or of the first JSON object.
+
+    CSV files go through LOAD DATA LOCAL INFILE when the server allows it.
+    Otherwise rows are converted to the column types and inserted as
+    multi-row executemany() batches of load_batch_rows, spread over
+    load_workers connections, each batch committed on its own. Rows that do
+    not convert, or that the server refuses, are skipped and reported.
+
+    Args:
+        cur: A cursor on the main connection, used to look up the columns.
+        path: The file to load.
+        table: The target table, optionally schema-qualified.
+    """
+    fmt = export_formats.get(os.path.splitext(path)[1].lower())
+    if fmt not in ('csv', 'jsonl'):
+        print(f"Unsupported load format: {path} (use .csv, .jsonl or .ndjson)")
+        return
+    if not os.path.exists(path):
+        print(f"No such file: {path}")
+        return
+    table_columns = load_table_columns(cur, table)
+    if not table_columns:
+        print(f"Unknown table: {table}")
+        return
+    columns = {column.lower(): column for column, _column_type in table_columns}
+    column_types = {column.lower(): column_type for column, column_type in table_columns}
+
+    started = time.time()
+    records = read_load_records(path, fmt)
+    try:
+        first = next(records, None)
+    except OSError as err:
+        print(f"Error reading {path}: {err}")
+        return
+    if first is None:
+        print("The file has no rows")
+        return
+    if first[1] is not None:
+        header = [field.lower() for field in first[1]]
+        unknown = [field for field in first[1] if field.lower() not in columns]
+        if len(unknown) == len(header):
+            print(f"No field of {path} matches a column of {table}")
+            return
+        if unknown:
+            print(f"Fields without a matching column are ignored: {', '.join(unknown)}")
+
+    local = None
+    if fmt == 'csv' and first[1] is not None and client_settings['load_local_infile']:
+        local = load_data_local(path, table, columns, header, column_types)
+    if local is not None:
+        loaded, warning_count, warnings = local
+        rejected, rejected_samples = 0, []
+        method = "LOAD DATA LOCAL INFILE"
+    else:
+        result, rejected_samples = insert_records(table, columns, column_types, itertools.chain([first], records))
+        if result is None:
+            return
+        loaded, rejected = result
+        warning_count, warnings = 0, []
+        method = f"{client_settings['load_workers']} connections, batches of {client_settings['load_batch_rows']}"
+
+    elapsed = time.time() - started
+    print(f"Loaded {loaded} rows into {table} in {elapsed:.2f} sec ({loaded / elapsed if elapsed else 0:.0f} rows/sec, "
+          f"{os.path.getsize(path) / 1048576 / elapsed if elapsed else 0:.1f} MB/sec) using {method}")
+    if rejected:
+        print(f"{rejected} rows rejected")
+        for line_number, reason in sorted(rejected_samples)[:10]:
+            print(f"  line {line_number}: {reason}")
+    if warning_count:
+        print(f"{warning_count} warnings (rows skipped as duplicate keys, or values adjusted to fit their column)")
+        for warning in warnings:
+            print(f"  {warning}")
+
+def insert_records(table, columns, column_types, records):
+    """
+    Inserts records with executemany() batches on load_workers connections.
+
+    Returns:
+        ((rows loaded, rows rejected), [(line number, reason), ...]), or (None, [])
+        if the load was interrupted.
+    """
+    header = None
+    converters = {}
+    work = queue.Queue(maxsize=client_settings['load_workers'] * 2)
+    stop = threading.Event()
+    lock = threading.Lock()
+    counts = {'loaded': 0, 'rejected': 0}
+    rejected_samples = []
+
+    def reject(line_number, reason):
+        with lock:
+            counts['rejected'] += 1
+            if len(rejected_samples) < 100:
+                rejected_samples.append((line_number, reason))
+
+    def worker():
+        try:
+            worker_conn = open_side_connection()
+        except mysql.connector.Error as err:
+            print(f"Error connecting to MySQL Platform: {err}")
+            stop.set()
+            return
+        worker_cur = worker_conn.cursor()
+        try:
+            while True:
+                batch = work.get()
+                if batch is None or stop.is_set():
+                    break
+                try:
+                    worker_cur.executemany(insert_sql, [row for _line_number, row in batch])
+                    with lock:
+                        counts['loaded'] += len(batch)
+                except mysql.connector.Error:
+                    for line_number, row in batch:  # Find the rows the server refuses
+                        try:
+                            worker_cur.execute(insert_sql, row)
+                            with lock:
+                                counts['loaded'] += 1
+                        except mysql.connector.Error as err:
+                            reject(line_number, err.msg)
+        finally:
+            worker_conn.close()
+
+    batch = []
+    threads = []
+    try:
+        for line_number, record, error in records:
+            if error:
+                reject(line_number, error)
+                continue
+            if header is None:
+                header = [field for field in record if field.lower() in columns]
+                converters = {field: column_converter(column_types[field.lower()]) for field in header}
+                insert_sql = (f"INSERT INTO {table} ({', '.join(f'`{columns[field.lower()]}`' for field in header)}) "
+                              f"VALUES ({', '.join(['%s'] * len(header))})")
+                threads = [threading.Thread(target=worker, daemon=True) for _ in range(client_settings['load_workers'])]
+                for thread in threads:
+                    thread.start()
+            try:
+                batch.append((line_number, tuple(converters[field](record.get(field)) for field in header)))
+            except ValueError as err:
+                reject(line_number, str(err))
+                continue
+            if len(batch) >= client_settings['load_batch_rows']:
+                while not stop.is_set():
+                    try:
+                        work.put(batch, timeout=0.5)
+                        break
+                    except queue.Full:
+                        pass
+                if stop.is_set():
+                    break
+                batch = []
+        if batch and not stop.is_set():
+            work.put(batch)
+    except KeyboardInterrupt:
+        stop.set()
+        print(f"\nInterrupted, {counts['loaded']} rows were already committed")
+    if stop.is_set():
+        while not work.empty():
+            work.get_nowait()  # Make room for the stop markers
+    for _thread in threads:
+        work.put(None)
+    for thread in threads:
+        thread.join()
+    if stop.is_set():
+        return None, []
+    return (counts['loaded'], counts['rejected']), rejected_samples
+
+CHUNKABLE_RE = re.compile(r"""
+    ^\s*(?:
+        UPDATE\s+(?:(?:LOW_PRIORITY|IGNORE)\s+)*(?P<update_table>[\w$.`]+)\s+SET\s
+      | DELETE\s+(?:(?:LOW_PRIORITY|QUICK|IGNORE)\s+)*FROM\s+(?P<delete_table>[\w$.`]+)(?:\s+WHERE\s|\s*$)
+    )""", re.VERBOSE | re.IGNORECASE)
+
+def mask_sql_literals(sql):
+    """Returns sql with quoted strings and comments blanked out, keeping every offset."""
+    return SQL_TOKEN_RE.sub(lambda m: " " * len(m.group(0)) if m.lastgroup != 'delimiter_command' else m.group(0), sql)
+
+def parse_chunkable_statement(sql):
+    """
+    Splits a single-table UPDATE or DELETE into its table, the statement
+    before WHERE and the WHERE condition.
+
+    Returns:
+        (table, head, condition), condition being None without WHERE, or
+        None (after printing why) if the statement cannot be chunked.
+    """
+    match = CHUNKABLE_RE.match(sql)
+    if not match:
+        print("\\chunk needs a single-table UPDATE ... SET or DELETE FROM statement")
+        return None
+    masked = mask_sql_literals(sql)
+    for keyword, pattern in (("ORDER BY", r"\bORDER\s+BY\b"), ("LIMIT", r"\bLIMIT\b"), ("JOIN", r"\bJOIN\b")):
+        if re.search(pattern, masked, re.IGNORECASE):
+            print(f"\\chunk cannot split a statement with {keyword}")
+            return None
+    table = match.group('update_table') or match.group('delete_table')
+    for where in re.finditer(r"\bWHERE\b", masked, re.IGNORECASE):
+        if masked.count("(", 0, where.start()) == masked.count(")", 0, where.start()):  # Not inside a subquery
+            return table, sql[:where.start()].rstrip(), sql[where.end():].strip()
+    return table, sql.rstrip(), None
+
+def primary_key_columns(cur, table):
+    """Returns the primary key columns of table (optionally schema-qualified), in index order."""
+    schema, _, name = table.replace("`", "").rpartition(".")
+    cur.execute("""
+        SELECT COLUMN_NAME FROM information_schema.KEY_COLUMN_USAGE
+        WHERE TABLE_SCHEMA = COALESCE(%s, DATABASE()) AND TABLE_NAME = %s AND CONSTRAINT_NAME = 'PRIMARY'
+        ORDER BY ORDINAL_POSITION""", (schema or None, name))
+    return [row[0] for row in cur.fetchall()]
+
+def replica_lag(cur):
+    """Returns the replication delay in seconds of the server behind cur, or None if it is not replicating."""
+    for statement in ("SHOW REPLICA STATUS", "SHOW SLAVE STATUS"):  # MySQL 8.0.22+, then older servers
+        try:
+            cur.execute(statement)
+        except mysql.connector.Error:
+            continue
+        lags = [row.get('Seconds_Behind_Source', row.get('Seconds_Behind_Master')) for row in cur.fetchall()]
+        lags = [int(lag) for lag in lags if lag is not None]
+        return max(lags) if lags else None
+    return None
+
+def wait_for_headroom(status_cur, replica_curs):
+    """
+    Blocks while Threads_running or replica lag are above the \\chunk limits.
+
+    Returns:
+        How loaded the servers are, as the highest fraction of a limit (0-1).
+    """
+    max_threads = client_settings['chunk_max_threads_running']
+    max_lag = client_settings['chunk_max_replica_lag']
+    while True:
+        threads = fetch_global_status(status_cur, ["Threads_running"]).get("Threads_running", 0)
+        lags = [lag for lag in (replica_lag(cur) for cur in [status_cur] + replica_curs) if lag is not None]
+        lag = max(lags) if lags else 0
+        if threads <= max_threads and lag <= max_lag:
+            return max(threads / max_threads if max_threads else 0, lag / max_lag if max_lag else 0)
+        print(f"\r  Paused: Threads_running {threads} (limit {max_threads}), replica lag {lag} sec (limit {max_lag})",
+              end="", flush=True)
+        time.sleep(1)
+
+def chunk_checkpoint_path(sql):
+    """Returns the resume file for a chunked statement on the current server and database."""
+    key = f"{db_config.get('host')}:{db_config.get('port')}/{db_config.get('database')}\n{sql}"
+    return os.path.join(cache_dir, f"chunk-{hashlib.sha1(key.encode('utf-8')).hexdigest()}.json")
+
+def pending_chunk_checkpoints():
+    """Returns the unfinished \\chunk checkpoints for the current server, most recent first."""
+    import glob
+
+    checkpoints = []
+    for path in glob.glob(os.path.join(cache_dir, "chunk-*.json")):
+        try:
+            with open(path) as f:
+                checkpoint = json.load(f)
+        except (OSError, ValueError):
+            continue
+        if (checkpoint['host'], checkpoint['port']) == (db_config.get('host'), db_config.get('port')):
+            checkpoints.append(checkpoint)
+    return sorted(checkpoints, key=lambda checkpoint: -checkpoint['updated'])
+
+def run_chunked(conn, sql):
+    """
+    Runs a large UPDATE or DELETE as a series of primary key range batches,
+    committing after each one.
+
+    Boundaries are found by walking the primary key index chunk_rows rows at a
+    time. Before every batch the server's Threads_running and the lag of the
+    server and of the chunk_replicas profiles are checked; the run pauses while
+    they are over the limits and slows down when they are close. Progress is
+    saved to cache_dir after every commit, so running the same statement again
+    (or \\chunk resume) continues where an interrupted run stopped.
+
+    Args:
+        conn: The main connection (autocommit off).
+        sql: The UPDATE or DELETE statement.
+    """
+    parsed = parse_chunkable_statement(sql)
+    if parsed is None:
+        return
+    table, head, condition = parsed
+    cur = conn.cursor(buffered=True)
+    status_cur = conn.cursor(dictionary=True)
+    pk = primary_key_columns(cur, table)
+    if not pk:
+        print(f"Table {table} has no primary key, \\chunk cannot split it")
+        return
+
+    checkpoint_file = chunk_checkpoint_path(sql)
+    try:
+        with open(checkpoint_file) as f:
+            checkpoint = json.load(f)
+        print(f"Resuming after {checkpoint['chunks']} chunks ({checkpoint['rows_changed']} rows changed)")
+    except (OSError, ValueError):
+        checkpoint = {'sql': sql, 'host': db_config.get('host'), 'port': db_config.get('port'),
+                      'database': db_config.get('database'), 'last': None, 'chunks': 0, 'rows_changed': 0}
+
+    schema, _, name = table.replace("`", "").rpartition(".")
+    cur.execute("SELECT TABLE_ROWS FROM information_schema.TABLES WHERE TABLE_SCHEMA = COALESCE(%s, DATABASE()) AND TABLE_NAME = %s",
+                (schema or None, name))
+    estimate = (cur.fetchone() or (None,))[0] or 0
+
+    columns = ", ".join(f"`{column}`" for column in pk)
+    placeholders = ", ".join(["%s"] * len(pk))
+    after_last = f"({columns}) > ({placeholders})"
+    filter_sql = f"({condition}) AND " if condition else ""
+    chunk_rows = client_settings['chunk_rows']
+
+    replica_conns = []
+    groups = load_profile_groups()
+    replica_names = client_settings['chunk_replicas']
+    for replica in (groups.get(replica_names, replica_names.split(",")) if replica_names else []):
+        config = profile_config(replica)
+        if config is None:
+            print(f"Unknown or invalid replica profile: {replica}")
+            continue
+        try:
+            replica_conn = mysql.connector.connect(**config)
+        except mysql.connector.Error as err:
+            print(f"Cannot watch replica {replica}, chunking without it: {err}")
+            continue
+        replica_conn.autocommit = True
+        replica_conns.append(replica_conn)
+
+    def run_chunk(last, upper):
+        bounds = [after_last] if last else []
+        if upper:
+            bounds.append(f"({columns}) <= ({placeholders})")
+        cur.execute(f"{head} WHERE {filter_sql}{' AND '.join(bounds) or 'TRUE'}", tuple(last or ()) + tuple(upper or ()))
+        return cur.rowcount
+
+    started = time.time()
+    scanned = 0
+    changed_this_run = 0
+    chunk_seconds = 0
+    try:
+        replica_curs = [replica_conn.cursor(dictionary=True) for replica_conn in replica_conns]
+        while True:
+            load = wait_for_headroom(status_cur, replica_curs)
+            if load > 0.5:
+                time.sleep(chunk_seconds)  # Close to a limit: leave the server as much idle time as the last batch took
+
+            last = checkpoint['last']
+            cur.execute(f"SELECT {columns} FROM {table}" + (f" WHERE {after_last}" if last else "") +
+                        f" ORDER BY {columns} LIMIT 1 OFFSET {chunk_rows - 1}", tuple(last or ()))
+            upper = cur.fetchone()
+
+            chunk_start = time.time()
+            changed = run_cancellable(conn, run_chunk, last, upper)
+            if changed is None:
+                conn.rollback()
+                print(f"\nStopped after {checkpoint['chunks']} chunks, \\chunk resume continues from there")
+                return
+            conn.commit()
+            chunk_seconds = time.time() - chunk_start
+
+            checkpoint['chunks'] += 1
+            checkpoint['rows_changed'] += changed
+            changed_this_run += changed
+            checkpoint['last'] = list(upper) if upper else None
+            checkpoint['updated'] = time.time()
+            if upper is None:
+                break
+            os.makedirs(cache_dir, exist_ok=True)
+            with open(checkpoint_file, 'w') as f:
+                json.dump(checkpoint, f, default=str)
+
+            scanned += chunk_rows
+            elapsed = time.time() - started
+            done = min(checkpoint['chunks'] * chunk_rows, estimate) if estimate else 0
+            eta = (estimate - done) / (scanned / elapsed) if estimate and elapsed else 0
+            print(f"\r  {checkpoint['chunks']} chunks, {checkpoint['rows_changed']} rows changed, "
+                  f"{changed_this_run / elapsed:.0f} rows/sec"
+                  + (f", ~{done * 100 // estimate}% done, ETA {eta:.0f} sec" if estimate else "") + " " * 10,
+                  end="", flush=True)
+    except KeyboardInterrupt as interrupt:
+        print(f"\nInterrupted after {checkpoint['chunks']} chunks, \\chunk resume continues from there")
+        if isinstance(interrupt, StatementAbandoned):
+            raise  # The connection is gone, the rollback happens on the server
+        conn.rollback()
+        return
+    finally:
+        for replica_conn in replica_conns:
+            replica_conn.close()
+
+    if os.path.exists(checkpoint_file):
+        os.remove(checkpoint_file)
+    print(f"\nDone: {checkpoint['rows_changed']} rows changed in {checkpoint['chunks']} chunks, {time.time() - started:.1f} sec")
+
+def browse_table(table, condition=None):
+    """
+    Pages through a table in primary key order with keyset (seek) queries,
+    so every page costs the same at any depth.
+
+    The pages are read on a separate connection by a background thread, which
+    fetches the next page while the current one is on screen.
+
+    Args:
+        table: The table, optionally schema-qualified.
+        condition: Optional WHERE condition.
+    """
+    import shutil
+
+    page_rows = client_settings['browse_rows'] or max(shutil.get_terminal_size().lines - 7, 5)
+    browse_conn = open_side_connection()
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)  # The only user of browse_conn
+    try:
+        pk = primary_key_columns(browse_conn.cursor(), table)  # Index order: the snapshot has table order
+        if not pk:
+            print(f"Table {table} has no primary key, \\browse cannot page through it")
+            return
+        columns = ", ".join(f"`{column}`" for column in pk)
+        placeholders = ", ".join(["%s"] * len(pk))
+        page_cur = browse_conn.cursor()
+
+        def fetch_page(bound, inclusive):
+            conditions = [f"({condition})"] if condition else []
+            if bound is not None:
+                conditions.append(f"({columns}) {'>=' if inclusive else '>'} ({placeholders})")
+            start_time = time.time()
+            page_cur.execute(f"SELECT * FROM {table}" + (f" WHERE {' AND '.join(conditions)}" if conditions else "") +
+                             f" ORDER BY {columns} LIMIT {page_rows}", tuple(bound or ()))
+            names = [desc[0] for desc in page_cur.description]
+            return names, page_cur.fetchall(), time.time() - start_time
+
+        names, rows, seconds = executor.submit(fetch_page, None, True).result()
+        lower_names = [name.lower() for name in names]
+        key_positions = [lower_names.index(column.lower()) for column in pk]
+        page_starts = [None]  # Start key of every page up to the current one
+        prefetched = False
+        while True:
+            if not rows:
+                print("No rows.")
+                return
+            print_streamed_results(names, [rows], sample_size=len(rows))
+            first_row = (len(page_starts) - 1) * page_rows + 1
+            print(f"Rows {first_row}-{first_row + len(rows) - 1}, page {len(page_starts)} "
+                  f"({seconds * 1000:.1f} ms{', prefetched' if prefetched else ''})")
+
+            last_page = len(rows) < page_rows
+            next_page = None if last_page else executor.submit(
+                fetch_page, [rows[-1][i] for i in key_positions], False)
+            while True:
+                try:
+                    answer = input("[Enter] next, [p]revious, [f]irst, [q]uit: ").strip().lower()
+                except (KeyboardInterrupt, EOFError):
+                    answer = "q"
+                if answer == "q":
+                    return
+                if answer in ("", "n") and next_page is not None:
+                    waited = time.time()
+                    next_names, next_rows, _seconds = next_page.result()
+                    if next_rows:
+                        page_starts.append([next_rows[0][i] for i in key_positions])
+                        names, rows, seconds, prefetched = next_names, next_rows, time.time() - waited, True
+                        break
+                    next_page = None
+                if answer in ("", "n"):
+                    print("This is the last page.")
+                elif answer in ("p", "f"):
+                    if answer == "p" and len(page_starts) > 1:
+                        page_starts.pop()
+                    elif answer == "f":
+                        del page_starts[1:]
+                    names, rows, seconds = executor.submit(fetch_page, page_starts[-1], True).result()
+                    prefetched = False
+                    break
+    finally:
+        executor.shutdown(wait=True)
+        browse_conn.close()
+
+def compare_tables(table, names):
+    """
+    Compares a table on two profiles without transferring its rows.
+
+    The table is split into primary key ranges of compare_chunk_rows rows
+    (boundaries walked on the first host), and each range is reduced on both
+    servers at once to COUNT(*), BIT_XOR and SUM of a per-row CRC32. Ranges
+    whose checksums differ are split again, ten times smaller each time,
+    until they are small enough to compare the CRC32 of every row, which
+    names the rows that are missing or different. Only keys and checksums
+    cross the network.
+
+    Args:
+        table: The table, optionally schema-qualified.
+        names: The two profile names.
+    """
+    configs = [profile_config(name) for name in names]
+    if None in configs:
+        print(f"Unknown or invalid profile: {names[configs.index(None)]} (profiles are read from {profiles_file})")
+        return
+    workers = max(1, client_settings['compare_workers'])
+    pools = [queue.Queue(), queue.Queue()]
+    opened = []
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers * 2)
+    try:
+        for pool, config in zip(pools, configs):
+            for _ in range(workers):
+                host_conn = mysql.connector.connect(**config)
+                host_conn.autocommit = True
+                opened.append(host_conn)
+                pool.put(host_conn)
+
+        def query(host, sql, params=()):
+            host_conn = pools[host].get()
+            try:
+                host_cur = host_conn.cursor()
+                host_cur.execute(sql, params)
+                rows = host_cur.fetchall()
+                host_cur.close()
+                return rows
+            finally:
+                pools[host].put(host_conn)
+
+        schema, _, name = table.replace("`", "").rpartition(".")
+        columns_sql = ("SELECT COLUMN_NAME, COLUMN_KEY FROM information_schema.COLUMNS "
+                       "WHERE TABLE_SCHEMA = COALESCE(%s, DATABASE()) AND TABLE_NAME = %s ORDER BY ORDINAL_POSITION")
+        host_columns = [query(host, columns_sql, (schema or None, name)) for host in (0, 1)]
+        if not host_columns[0]:
+            print(f"Table {table} does not exist on {names[0]}")
+            return
+        if [column for column, _key in host_columns[0]] != [column for column, _key in host_columns[1]]:
+            print(f"The columns of {table} differ between {names[0]} and {names[1]}, nothing to compare")
+            return
+        pk = primary_key_columns(opened[0].cursor(buffered=True), table)
+        if not pk:
+            print(f"Table {table} has no primary key, \\compare cannot split it")
+            return
+
+        key_sql = ", ".join(f"`{column}`" for column in pk)
+        placeholders = ", ".join(["%s"] * len(pk))
+        all_columns = [f"`{column}`" for column, _key in host_columns[0]]
+        row_crc = (f"CRC32(CONCAT_WS('#', {', '.join(all_columns)}, "
+                   f"CONCAT({', '.join(f'ISNULL({column})' for column in all_columns)})))")
+
+        def range_condition(lower, upper, extra=""):
+            conditions, params = [], ()
+            if lower is not None:
+                conditions.append(f"({key_sql}) > ({placeholders})")
+                params += tuple(lower)
+            if upper is not None:
+                conditions.append(f"({key_sql}) <= ({placeholders})")
+                params += tuple(upper)
+            return (f" WHERE {' AND '.join(conditions)}" if conditions else "") + extra, params
+
+        def range_bounds(host, lower, upper, size):
+            """Yields consecutive (lower, upper] key ranges of about size rows covering (lower, upper]."""
+            while True:
+                condition, params = range_condition(lower, upper)
+                rows = query(host, f"SELECT {key_sql} FROM {table}{condition} ORDER BY {key_sql} "
+                                   f"LIMIT 1 OFFSET {size - 1}", params)
+                bound = tuple(rows[0]) if rows else None
+                if bound is None or bound == upper:
+                    yield lower, upper
+                    return
+                yield lower, bound
+                lower = bound
+
+        def checksum(host, lower, upper):
+            condition, params = range_condition(lower, upper)
+            return tuple(query(host, f"SELECT COUNT(*), COALESCE(BIT_XOR({row_crc}), 0), "
+                                     f"COALESCE(SUM({row_crc}), 0) FROM {table}{condition}", params)[0])
+
+        def checksum_both(lower, upper):
+            futures = [executor.submit(checksum, host, lower, upper) for host in (0, 1)]
+            return [future.result() for future in futures]
+
+        differences = []
+        difference_count = collections.Counter()
+
+        def compare_rows(lower, upper):
+            condition, params = range_condition(lower, upper, f" ORDER BY {key_sql}")
+            futures = [executor.submit(query, host, f"SELECT {key_sql}, {row_crc} FROM {table}{condition}", params)
+                       for host in (0, 1)]
+            row_crcs = [{tuple(row[:-1]): row[-1] for row in future.result()} for future in futures]
+            for key in sorted(row_crcs[0].keys() | row_crcs[1].keys()):
+                if key not in row_crcs[1]:
+                    kind = f"only on {names[0]}"
+                elif key not in row_crcs[0]:
+                    kind = f"only on {names[1]}"
+                elif row_crcs[0][key] != row_crcs[1][key]:
+                    kind = "different"
+                else:
+                    continue
+                difference_count[kind] += 1
+                if len(differences) < 1000:
+                    differences.append((kind, key))
+
+        def drill_down(lower, upper, counts):
+            if max(counts) <= client_settings['compare_row_level']:
+                compare_rows(lower, upper)
+                return
+            size = max(max(counts) // 10, client_settings['compare_row_level'])
+            bigger = 0 if counts[0] >= counts[1] else 1  # Split on the host that has the rows
+            for sub_lower, sub_upper in range_bounds(bigger, lower, upper, size):
+                sums = checksum_both(sub_lower, sub_upper)
+                if sums[0] != sums[1]:
+                    drill_down(sub_lower, sub_upper, (sums[0][0], sums[1][0]))
+
+        started = time.time()
+        row_counts = [0, 0]
+        chunks = differing_chunks = 0
+        pending = collections.deque()
+
+        def finish_chunk():
+            nonlocal chunks, differing_chunks
+            lower, upper, futures = pending.popleft()
+            sums = [future.result() for future in futures]
+            chunks += 1
+            row_counts[0] += sums[0][0]
+            row_counts[1] += sums[1][0]
+            if sums[0] != sums[1]:
+                differing_chunks += 1
+                drill_down(lower, upper, (sums[0][0], sums[1][0]))
+            elapsed = time.time() - started
+            print(f"\r  {chunks} chunks, {row_counts[0]} rows compared ({row_counts[0] / elapsed if elapsed else 0:.0f} rows/sec), "
+                  f"{differing_chunks} differing chunks", end="", flush=True)
+
+        try:
+            for lower, upper in range_bounds(0, None, None, client_settings['compare_chunk_rows']):
+                pending.append((lower, upper, [executor.submit(checksum, host, lower, upper) for host in (0, 1)]))
+                while len(pending) > workers or (pending and all(future.done() for future in pending[0][2])):
+                    finish_chunk()
+            while pending:
+                finish_chunk()
+        except KeyboardInterrupt:
+            print("\nInterrupted, the results below are incomplete")
+
+        print(f"\n{table}: {row_counts[0]} rows on {names[0]}, {row_counts[1]} rows on {names[1]}, "
+              f"{chunks} chunks in {time.time() - started:.1f} sec")
+        if not difference_count:
+            print("No differences found.")
+            return
+        print(", ".join(f"{count} rows {kind}" for kind, count in difference_count.items()))
+        for kind, key in differences[:20]:
+            print(f"  {kind:<24} {', '.join(f'{column}={value!r}' for column, value in zip(pk, key))}")
+        if sum(difference_count.values()) > 20:
+            print("  ...")
+    finally:
+        executor.shutdown(wait=True)
+        for host_conn in opened:
+            host_conn.close()
+
+def fanout_worker(name, config, sql, events, cancelled):
+    """
+    Runs one statement for \fanout on its own connection and reports through events.
+
+    Puts ('columns', name, column_names) and ('rows', name, rows) while the
+    result is fetched, and always finishes with ('done', name, (seconds, rows, error)).
+
+    Args:
+        name: The profile name, used to tag the events.
+        config: Connection settings for the host.
+        sql: The statement to run.
+        events: Queue shared with fanout_statement().
+        cancelled: Event set when the user pressed Ctrl-C; fetching stops early.
+    """
+    started = time.time()
+    row_count = 0
+    error = None
+    try:
+        fan_conn = mysql.connector.connect(**config)
+        try:
+            fan_conn.autocommit = True
+            fan_cur = fan_conn.cursor()
+            fan_cur.execute(sql)
+            if fan_cur.description:
+                events.put(('columns', name, [col[0] for col in fan_cur.description]))
+                for batch in fetch_batches(fan_cur, client_settings['stream_batch_rows']):
+                    events.put(('rows', name, batch))
+                    row_count += len(batch)
+                    if cancelled.is_set():
+                        error = "cancelled"
+                        break
+            else:
+                row_count = fan_cur.rowcount
+        finally:
+            fan_conn.close()
+    except Exception as err:  # Anything, fanout_statement() waits for 'done' from every host
+        error = str(err)
+    finally:
+        events.put(('done', name, (time.time() - started, row_count, error)))
+
+def fanout_statement(names, sql):
+    """
+    Runs a statement on several profiles at once and prints one merged result
+    set, tagged with the source of each row, followed by per-host timings.
+
+    Rows are printed while the hosts are still sending them. At most
+    fanout_workers hosts run at the same time, so the elapsed time is that
+    of the slowest host rather than the sum of all of them.
+
+    Args:
+        names: The profile names to run the statement on.
+        sql: The statement.
+    """
+    configs = {name: profile_config(name) for name in names}
+    unknown = [name for name, config in configs.items() if config is None]
+    if unknown:
+        print(f"Unknown or invalid profile(s): {', '.join(unknown)}")
+        return
+
+    workers = max(1, min(client_settings['fanout_workers'], len(names)))
+    events = queue.Queue(maxsize=workers * 4)  # Bounds the rows buffered ahead of printing
+    cancelled = threading.Event()
+    results = {}
+    host_columns = {}
+    columns = []  # Filled in by merged_batches() before print_streamed_results() sizes the table
+
+    def merged_batches():
+        while len(results) < len(names):
+            kind, name, payload = events.get()
+            if kind == 'done':
+                results[name] = payload
+            elif kind == 'columns':
+                host_columns[name] = payload
+                if not columns:
+                    columns[:] = ["source"] + payload
+            elif host_columns[name] == columns[1:]:
+                yield [(name,) + tuple(row) for row in payload]
+
+    started = time.time()
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+    for name in names:
+        executor.submit(fanout_worker, name, configs[name], sql, events, cancelled)
+    try:
+        row_count = print_streamed_results(columns, merged_batches())
+    except KeyboardInterrupt:
+        print("\nCancelling, waiting for running hosts...")
+        cancelled.set()
+        row_count = None
+        for _batch in merged_batches():
+            pass  # Drain the queue so no worker stays blocked on it
+    executor.shutdown(wait=True)
+    elapsed = time.time() - started
+
+    if row_count == 0 and columns:
+        print("Empty set")
+    failed = 0
+    print(f"{'source':<20} {'host':<28} {'ms':>9} {'rows':>9}  error")
+    for name, (seconds, rows, error) in sorted(results.items(), key=lambda item: -item[1][0]):
+        if error is None and name in host_columns and host_columns[name] != columns[1:]:
+            error = f"different columns: {', '.join(host_columns[name])}"
+        failed += error is not None
+        host = f"{configs[name].get('host')}:{configs[name].get('port')}"
+        print(f"{name:<20} {host:<28} {seconds * 1000:>9.1f} {rows:>9}  {error or ''}")
+    print(f"{len(names)} hosts ({failed} failed) in {elapsed:.3f} sec, "
+          f"{sum(seconds for seconds, _rows, _error in results.values()):.3f} sec of host time")
+
+BENCH_OPTION_RE = re.compile(r"\s*-([ncdp])\s+(\S+)")
+
+# Upper bounds in milliseconds of the \bench latency histogram buckets
+latency_buckets = (0.1, 0.2, 0.5, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, float("inf"))
+
+def latency_histogram(latencies, width=40):
+    """Returns the lines of a text histogram of latencies (in seconds), over the buckets that are in use."""
+    counts = [0] * len(latency_buckets)
+    for latency in latencies:
+        counts[bisect.bisect_left(latency_buckets, latency * 1000)] += 1
+    used = [i for i, count in enumerate(counts) if count]
+    if not used:
+        return []
+    lines = []
+    for i in range(used[0], used[-1] + 1):
+        low = latency_buckets[i - 1] if i else 0
+        label = f"> {low:g} ms" if latency_buckets[i] == float("inf") else f"{low:g} - {latency_buckets[i]:g} ms"
+        bar = "#" * math.ceil(counts[i] * width / max(counts))
+        lines.append(f"  {label:>18} {counts[i]:>9}  {bar}")
+    return lines
+
+def bench_statement(sql, iterations=100, concurrency=1, duration=None, params=None):
+    """
+    Runs a statement repeatedly on concurrency connections and prints
+    throughput, latency percentiles, errors and a latency histogram.
+
+    Every iteration executes the statement and reads its whole result, and is
+    timed on its own. Worker connections use the session's db_config.
+
+    Args:
+        sql: The statement; %s placeholders are filled from params.
+        iterations: Total executions, ignored when duration is given.
+        concurrency: Number of worker connections.
+        duration: Run for this many seconds instead of a number of iterations.
+        params: Parameter rows, used round-robin.
+    """
+    latencies = []
+    errors = collections.Counter()
+    lock = threading.Lock()
+    stop = threading.Event()
+    counter = itertools.count()
+    deadline = time.time() + duration if duration else None
+    running = [concurrency]
+    all_done = threading.Event()  # Not Thread.join(): a Ctrl-C inside join() can make is_alive() lie
+
+    def worker():
+        try:
+            run_worker()
+        finally:
+            with lock:
+                running[0] -= 1
+                if not running[0]:
+                    all_done.set()
+
+    def run_worker():
+        try:
+            bench_conn = open_side_connection()
+        except mysql.connector.Error as err:
+            with lock:
+                errors[f"connect: {err}"] += 1
+            return
+        bench_cur = bench_conn.cursor()
+        worker_latencies = []
+        try:
+            while not stop.is_set():
+                with lock:
+                    iteration = next(counter)
+                if (deadline and time.time() >= deadline) or (not deadline and iteration >= iterations):
+                    break
+                start_time = time.perf_counter()
+                try:
+                    bench_cur.execute(sql, params[iteration % len(params)] if params else None)
+                    if bench_cur.description:
+                        bench_cur.fetchall()
+                    worker_latencies.append(time.perf_counter() - start_time)
+                except mysql.connector.Error as err:
+                    with lock:
+                        errors[f"{err.errno}: {err.msg}" if err.errno else str(err)] += 1
+        finally:
+            with lock:
+                latencies.extend(worker_latencies)
+            bench_conn.close()
+
+    print(f"Running {f'for {duration:g} sec' if duration else f'{iterations} times'} on {concurrency} connections, Ctrl-C to stop")
+    workers = [threading.Thread(target=worker, daemon=True) for _ in range(concurrency)]
+    started = time.time()
+    for thread in workers:
+        thread.start()
+    try:
+        while not all_done.wait(0.2):  # Short waits keep Ctrl-C responsive
+            pass
+    except KeyboardInterrupt:
+        stop.set()
+        print("\nStopping...")
+        all_done.wait()
+    elapsed = time.time() - started
+
+    latencies.sort()
+    completed = len(latencies)
+    failed = sum(errors.values())
+    print(f"{completed} ok, {failed} errors in {elapsed:.2f} sec: {completed / elapsed if elapsed else 0:.1f} queries/sec")
+    if latencies:
+        print(f"Latency ms: min {latencies[0] * 1000:.2f}  p50 {percentile(latencies, 50) * 1000:.2f}  "
+              f"p95 {percentile(latencies, 95) * 1000:.2f}  p99 {percentile(latencies, 99) * 1000:.2f}  "
+              f"max {latencies[-1] * 1000:.2f}  mean {sum(latencies) / completed * 1000:.2f}")
+        print("\n".join(latency_histogram(latencies)))
+    for message, count in errors.most_common(5):
+        print(f"  {count:>9} x {message}")
+
+def meta_command(name, help_text):
+    """Registers a handler for the backslash command \\<name>."""
+    def register(func):
+        meta_commands[name] = (func, help_text)
+        return func
+    return register
+
+def run_meta_command(conn, line):
+    """
+    Runs a backslash command such as "\\stream on".
+
+    Args:
+        conn: The current database connection.
+        line: The command line, including the leading backslash.
+
+    Returns:
+        Whatever the handler returns (a replacement connection, or None).
+    """
+    name, _, arg = line.strip()[1:].partition(" ")
+    if name not in meta_commands:
+        print(f"Unknown command: \\{name} (try \\help)")
+        return None
+    handler, _help_text = meta_commands[name]
+    return handler(conn, arg.strip())
+
+@meta_command("help", "List the available backslash commands")
+def meta_help(conn, arg):
+    """Prints the registered backslash commands."""
+    for name, (_handler, help_text) in sorted(meta_commands.items()):
+        print(f"  \\{name:<12} {help_text}")
+
+@meta_command("stream", "[on|off] Print result sets while fetching them, with bounded memory")
+def meta_stream(conn, arg):
+    """Turns streaming result output on or off."""
+    if arg.lower() in ("on", "off"):
+        client_settings['stream'] = arg.lower() == "on"
+    print(f"Streaming results: {'on' if client_settings['stream'] else 'off'}")
+
+@meta_command("timeout", "[seconds] Cancel statements running longer than this (0 disables)")
+def meta_timeout(conn, arg):
+    """Shows or sets the per-statement time limit."""
+    if arg:
+        try:
+            client_settings['statement_timeout'] = float(arg)
+        except ValueError:
+            print(f"Invalid timeout: {arg}")
+            return
+    timeout = client_settings['statement_timeout']
+    print(f"Statement timeout: {f'{timeout:g} sec' if timeout else 'off'}")
+
+@meta_command("o", "[file] Export result sets to a .csv/.jsonl/.parquet file, \\o alone goes back to the terminal")
+def meta_output(conn, arg):
+    """Redirects result sets to a file, or back to the terminal."""
+    if not arg:
+        client_settings['output_file'] = None
+        print("Results go to the terminal")
+        return
+    path = os.path.expanduser(arg)
+    if export_format(path):
+        client_settings['output_file'] = path
+        print(f"Results go to {path} (each statement replaces its contents)")
+
+@meta_command("cache", "[on|off|clear] Show or control the GenAI translation cache")
+def meta_cache(conn, arg):
+    """Shows translation cache statistics, turns the cache on/off or clears it."""
+    if arg.lower() in ("on", "off"):
+        client_settings['translation_cache'] = arg.lower() == "on"
+    elif arg.lower() == "clear":
+        open_translation_cache().execute("DELETE FROM translations")
+        print("Translation cache cleared")
+    elif arg:
+        print(f"Unknown option: {arg}")
+        return
+    entries = open_translation_cache().execute("SELECT COUNT(*) FROM translations").fetchone()[0]
+    lookups = translation_cache_stats['hits'] + translation_cache_stats['misses']
+    hit_ratio = translation_cache_stats['hits'] / lookups * 100 if lookups else 0
+    print(f"Translation cache: {'on' if client_settings['translation_cache'] else 'off'}, {entries} entries, "
+          f"{translation_cache_stats['hits']} hits / {translation_cache_stats['misses']} misses ({hit_ratio:.0f}%) this session")
+
+@meta_command("status", "Show server version, uptime and important status counters")
+def meta_status(conn, arg):
+    """Prints the server status part of the banner."""
+    status_cur = conn.cursor(dictionary=True)
+    try:
+        print_server_status(status_cur)
+    finally:
+        status_cur.close()
+
+@meta_command("top", "[seconds] Live server monitor with per-second rates, Ctrl-C to leave")
+def meta_top(conn, arg):
+    """Polls global status and the processlist on a dedicated connection and redraws in place."""
+    import shutil
+
+    try:
+        interval = float(arg) if arg else 2.0
+    except ValueError:
+        print(f"Invalid interval: {arg}")
+        return
+    names = [name for name, _label in top_rate_variables + top_gauge_variables] + [
+        "Innodb_buffer_pool_reads", "Innodb_buffer_pool_read_requests"]
+
+    top_conn = open_side_connection()
+    top_cur = top_conn.cursor(dictionary=True)
+    try:
+        processlist_sql = processlist_query(top_cur)
+        previous = fetch_global_status(top_cur, names)
+        previous_time = time.time()
+        while True:
+            time.sleep(interval)
+            current = fetch_global_status(top_cur, names)
+            now = time.time()
+            top_cur.execute(processlist_sql)
+            processes = top_cur.fetchall()
+
+            width = shutil.get_terminal_size().columns
+            output = [f"mysqlc top - {db_config.get('host')} - {time.strftime('%H:%M:%S')} "
+                      f"(every {interval:g} sec, Ctrl-C to leave)", ""]
+            rates = status_rates(previous, current, now - previous_time)
+            for i in range(0, len(rates), 2):
+                output.append("   ".join(f"{label:<24}{value:>14}" for label, value in rates[i:i + 2]))
+            output += ["", f"{'ID':>8} {'USER':<12} {'DB':<12} {'TIME':>6} {'STATE':<20} INFO"]
+            for process in processes:
+                info = " ".join(str(process['INFO'] or process['COMMAND']).split())
+                output.append(f"{process['ID']:>8} {str(process['USER'])[:12]:<12} {str(process['DB'] or '')[:12]:<12} "
+                              f"{process['TIME']:>6} {str(process['STATE'] or '')[:20]:<20} {info}")
+            print("\033[H\033[2J" + "\n".join(line[:width] for line in output), flush=True)
+            previous, previous_time = current, now
+    except KeyboardInterrupt:
+        print()
+    finally:
+        try:
+            top_conn.close()
+        except mysql.connector.Error:
+            pass  # Interrupted mid-query, the server drops the connection anyway
+
+@meta_command("timing", "[on|off] Show execute/fetch/convert/render times after each statement")
+def meta_timing(conn, arg):
+    """Turns the inline per-phase timing line on or off."""
+    if arg.lower() in ("on", "off"):
+        client_settings['show_timing'] = arg.lower() == "on"
+    print(f"Phase timing: {'on' if client_settings['show_timing'] else 'off'}")
+
+@meta_command("stats", "[json <file>|reset] Session latency percentiles per statement digest")
+def meta_stats(conn, arg):
+    """Prints per-digest latency percentiles, exports the timings as JSON, or resets them."""
+    option, _, path = arg.partition(" ")
+    if option == "reset":
+        statement_timings.clear()
+        digest_latencies.clear()
+        print("Statistics reset")
+        return
+    if option == "json":
+        if not path:
+            print("Usage: \\stats json <file>")
+            return
+        try:
+            with open(os.path.expanduser(path.strip()), 'w') as f:
+                json.dump({'digests': digest_statistics(), 'statements': list(statement_timings)}, f, indent=2)
+        except OSError as err:
+            print(f"Error writing {path.strip()}: {err}")
+            return
+        print(f"Wrote {len(statement_timings)} statement timings to {path.strip()}")
+        return
+
+    stats = digest_statistics()
+    if not stats:
+        print("No statements timed yet.")
+        return
+    print(f"{'count':>7} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9} {'total s':>9}  digest")
+    for stat in stats[:20]:
+        print(f"{stat['count']:>7} {stat['p50'] * 1000:>9.1f} {stat['p95'] * 1000:>9.1f} {stat['p99'] * 1000:>9.1f} "
+              f"{stat['max'] * 1000:>9.1f} {stat['total']:>9.3f}  {stat['digest'][:80]}")
+
+@meta_command("explain", "<sql|#N> Explain a statement (or \\digests entry N) and flag scans, filesorts, temp tables and missing indexes")
+def meta_explain(conn, arg):
+    """Explains the given statement, or the sample statement of a \\digests entry, without running it."""
+    if not arg:
+        print("Usage: \\explain <sql | #N>")
+        return
+    match = re.fullmatch(r"#(\d+)", arg.strip())
+    if not match:
+        explain_statement(conn, arg.rstrip("; \n"))
+        return
+
+    number = int(match.group(1))
+    if not 1 <= number <= len(last_digests):
+        print("No such digest (run \\digests first)")
+        return
+    digest = last_digests[number - 1]
+    if not digest['sample']:
+        print(f"The server keeps no sample statement for this digest: {digest['digest_text']}")
+        return
+    print(f"Explaining: {digest['sample']}")
+    database = conn.database
+    if digest['schema'] and digest['schema'] != database:
+        conn.database = digest['schema']
+    try:
+        explain_statement(conn, digest['sample'])
+    finally:
+        if conn.database != database and database:
+            conn.database = database
+
+@meta_command("autoexplain", "[seconds|off] Explain SELECTs that take longer than this")
+def meta_autoexplain(conn, arg):
+    """Shows or sets the auto-explain threshold."""
+    if arg:
+        try:
+            client_settings['auto_explain'] = 0 if arg.lower() == "off" else float(arg)
+        except ValueError:
+            print(f"Invalid threshold: {arg}")
+            return
+    threshold = client_settings['auto_explain']
+    print(f"Auto-explain: {f'SELECTs over {threshold:g} sec' if threshold else 'off'}")
+
+@meta_command("connect", "[profile] Switch to a named connection profile, reusing its open connection")
+def meta_connect(conn, arg):
+    """Lists the connection profiles, or makes another profile the current connection."""
+    global active_profile, control_conn
+    if not arg:
+        names = ["default"] + sorted(set(load_profiles()) | set(profile_sessions) - {"default"})
+        for name in names:
+            config = profile_config(name)
+            if config is None:
+                continue
+            marker = "*" if name == active_profile else " "
+            state = "open" if name in profile_sessions and profile_sessions[name]['conn'] is not None else ""
+            print(f" {marker} {name:<20} {config.get('user')}@{config.get('host')}:{config.get('port')}/{config.get('database') or ''}  {state}")
+        return
+    if arg == active_profile:
+        print(f"Already connected to {arg}")
+        return
+    config = profile_config(arg)
+    if config is None:
+        print(f"Unknown profile: {arg} (profiles are read from {profiles_file})")
+        return
+
+    started = time.time()
+    current = profile_sessions[active_profile]
+    current['conn'] = conn
+    current['config'] = dict(db_config)  # Remembers the database selected with USE
+    target = profile_sessions.get(arg)
+    pooled = target is not None and target['conn'] is not None and target['conn'].is_connected()
+    if not pooled:
+        statements = target['session_statements'] if target else []
+        target = profile_sessions[arg] = {
+            'conn': reconnect(config, statements), 'config': config, 'session_statements': statements}
+
+    db_config.update(target['config'])
+    for key in set(db_config) - set(target['config']):
+        del db_config[key]
+    active_profile = arg
+    if control_conn is not None:  # KILL QUERY must go to the new server
+        try:
+            control_conn.close()
+        except mysql.connector.Error:
+            pass
+        control_conn = None
+    print(f"Connected to {arg} ({db_config.get('host')}:{db_config.get('port')}) in "
+          f"{(time.time() - started) * 1000:.1f} ms ({'pooled' if pooled else 'new'} connection)")
+    return target['conn']
+
+@meta_command("fanout", "<group|profile,...> <sql> Run a statement on many hosts at once and merge the results")
+def meta_fanout(conn, arg):
+    """Runs a statement on every profile of a group (or a comma-separated profile list)."""
+    target, _, sql = arg.partition(" ")
+    sql = sql.strip().rstrip(";")
+    groups = load_profile_groups()
+    if not target or not sql:
+        print("Usage: \\fanout <group|profile,...> <sql>")
+        for group, members in sorted(groups.items()):
+            print(f"  {group:<20} {', '.join(members)}")
+        return
+    fanout_statement(groups[target] if target in groups else target.split(","), sql)
+
+@meta_command("chunk", "[size N|replicas <group>|resume] <UPDATE|DELETE> Run a big write in committed primary key batches")
+def meta_chunk(conn, arg):
+    """Runs an UPDATE/DELETE in throttled batches, changes the batch settings, or resumes a run."""
+    option, _, value = arg.partition(" ")
+    value = value.strip()
+    if option == "size" and value:
+        try:
+            client_settings['chunk_rows'] = max(1, int(value))
+        except ValueError:
+            print(f"Invalid size: {value}")
+            return
+    elif option == "replicas" and value:
+        client_settings['chunk_replicas'] = None if value == "off" else value
+    elif option == "resume":
+        checkpoints = pending_chunk_checkpoints()
+        if not checkpoints:
+            print("Nothing to resume")
+            return
+        if checkpoints[0]['database'] != db_config.get('database'):
+            print(f"The last interrupted run was in database {checkpoints[0]['database']}, USE it first")
+            return
+        run_chunked(conn, checkpoints[0]['sql'])
+        return
+    elif arg:
+        run_chunked(conn, arg.rstrip("; \n"))
+        return
+
+    print(f"Chunk size: {client_settings['chunk_rows']} rows, pause above {client_settings['chunk_max_threads_running']} "
+          f"running threads or {client_settings['chunk_max_replica_lag']} sec lag, "
+          f"replicas watched: {client_settings['chunk_replicas'] or 'none'}")
+    for checkpoint in pending_chunk_checkpoints():
+        print(f"  interrupted after {checkpoint['chunks']} chunks [{checkpoint['database']}]: {checkpoint['sql']}")
+
+@meta_command("load", "[batch N|workers N|local on|off] <file> INTO <table> Load a CSV (with header) or JSONL file into a table")
+def meta_load(conn, arg):
+    """Loads a file into a table, or changes the load settings."""
+    option, _, value = arg.partition(" ")
+    value = value.strip()
+    if option in ("batch", "workers") and value.isdigit():
+        client_settings['load_batch_rows' if option == "batch" else 'load_workers'] = max(1, int(value))
+    elif option == "local" and value in ("on", "off"):
+        client_settings['load_local_infile'] = value == "on"
+    elif arg:
+        match = LOAD_STATEMENT_RE.match(arg)
+        if not match:
+            print("Usage: \\load <file.csv|file.jsonl> INTO <table>, or \\load batch N|workers N|local on|off")
+            return
+        load_cur = conn.cursor()
+        try:
+            load_file(load_cur, os.path.expanduser(match.group('path').strip().strip("'\"")), match.group('table'))
+        finally:
+            load_cur.close()
+        return
+
+    print(f"Load: batches of {client_settings['load_batch_rows']} rows on {client_settings['load_workers']} connections, "
+          f"LOAD DATA LOCAL INFILE for CSV {'on' if client_settings['load_local_infile'] else 'off'}")
+
+@meta_command("last", "[list|#N] [where <cond> [and ...]] [sort <col> [desc]] [head <n>] Re-show a kept result locally")
+def meta_last(conn, arg):
+    """Filters, sorts and re-prints one of the last result sets without querying the server."""
+    if arg.strip().lower() == "list":
+        for number, result in enumerate(last_results, 1):
+            print(f"  #{number:<3} {result['rows']:>9} rows {len(result['columns']):>3} cols "
+                  f"{result['size'] / 1048576:>7.1f} MB  {' '.join(result['sql'].split())[:80]}")
+        return
+    match = re.match(r"\s*#(\d+)", arg)
+    number = int(match.group(1)) if match else 1
+    if not 1 <= number <= len(last_results):
+        print("No such result (see \\last list)" if last_results else "No result sets kept yet")
+        return
+    result = last_results[number - 1]
+
+    start_time = time.time()
+    try:
+        rows = select_last_rows(result, arg[match.end():] if match else arg)
+    except ValueError as err:
+        print(err)
+        return
+    selected = [tuple(values[i] for values in result['data']) for i in rows]
+    if selected:
+        print_streamed_results(result['columns'], [selected], sample_size=len(selected))
+    print(f"{len(selected)} of {result['rows']} rows ({(time.time() - start_time) * 1000:.1f} ms, local)")
+
+@meta_command("bench", "[-n N] [-c C] [-d sec] [-p params.csv] <sql|!id> Load test a statement on C connections")
+def meta_bench(conn, arg):
+    """Parses the \bench options and runs the load test."""
+    options = {'n': "100", 'c': "1"}
+    pos = 0
+    while True:
+        match = BENCH_OPTION_RE.match(arg, pos)
+        if not match:
+            break
+        options[match.group(1)] = match.group(2)
+        pos = match.end()
+    sql = arg[pos:].strip().rstrip(";")
+    if not sql:
+        print("Usage: \\bench [-n iterations] [-c connections] [-d seconds] [-p params.csv] <sql | !history-id>")
+        return
+    if sql.startswith("!"):
+        try:
+            sql = get_history(int(sql[1:]))
+        except ValueError:
+            sql = None
+        if sql is None:
+            print("Invalid history command.")
+            return
+        print(f"Benchmarking: {sql}")
+    try:
+        iterations, concurrency = int(options['n']), max(1, int(options['c']))
+        duration = float(options['d']) if 'd' in options else None
+    except ValueError as err:
+        print(f"Invalid option: {err}")
+        return
+
+    params = None
+    if 'p' in options:
+        try:
+            with open(os.path.expanduser(options['p']), newline='') as f:
+                params = [tuple(row) for row in csv.reader(f) if row]
+        except OSError as err:
+            print(f"Error reading parameters: {err}")
+            return
+        if not params:
+            print(f"No parameter rows in {options['p']}")
+            return
+    bench_statement(sql, iterations, concurrency, duration, params)
+
+@meta_command("digests", "[seconds] [latency|rows|tmpdisk|noindex] Top statement digests over an interval")
+def meta_digests(conn, arg):
+    """Ranks the statement digests that ran during the next few seconds."""
+    interval, ranking = 10.0, "latency"
+    for option in arg.split():
+        if option.lower() in digest_rankings:
+            ranking = option.lower()
+        else:
+            try:
+                interval = float(option)
+            except ValueError:
+                print(f"Unknown option: {option} (rank by {', '.join(digest_rankings)})")
+                return
+    top_digests(conn, interval, ranking)
+
+@meta_command("browse", "<table> [where <condition>] Page through a table in primary key order")
+def meta_browse(conn, arg):
+    """Starts the keyset pagination browser."""
+    match = re.match(r"\s*([\w$.`]+)(?:\s+where\s+(.+))?\s*;?\s*$", arg, re.IGNORECASE | re.DOTALL)
+    if not match:
+        print("Usage: \\browse <table> [where <condition>]")
+        return
+    browse_table(match.group(1), match.group(2))
+
+@meta_command("compare", "<table> <profileA> <profileB> Find rows that differ between two hosts using checksums")
+def meta_compare(conn, arg):
+    """Compares a table on two connection profiles."""
+    parts = arg.split()
+    if len(parts) != 3:
+        print("Usage: \\compare <table> <profileA> <profileB> (\"default\" is the startup connection)")
+        return
+    compare_tables(parts[0], parts[1:])
+
+def launch():
+    conn = None
+    cur = None
+    model = None
+    chat_history = []
+    schema_needs_update = True
+    syntax_highlighting_enabled = False  # Flag for syntax highlighting
+    mark_startup_phase("imports")
+
+    # Set up command-line arguments
+    parser = argparse.ArgumentParser(description='A Smarter Modern MySQL client')
+    parser.add_argument('--port', help='MySQL port', type=int, default=3306)
+    parser.add_argument('-u', '--user', help='MySQL username')
+    parser.add_argument('-p', '--password', help='MySQL password')
+    parser.add_argument('-H', '--host', help='MySQL host')
+    parser.add_argument('-d', '--database', help='Default database')
+    parser.add_argument('-g', '--gemini_api_key', help='Gemini API key')
+    parser.add_argument('-s', '--syntax-highlighting', action='store_true', help='Enable syntax highlighting')
+    parser.add_argument('--no-password', action='store_true', help='Do not use a password even if it is in env variables')
+    parser.add_argument('--stream', action='store_true', help='Stream result sets instead of fetching them whole')
+    parser.add_argument('--schema-refresh', type=int, help='Seconds between background schema re-checks (0 disables)')
+    parser.add_argument('--timeout', type=float, help='Cancel statements running longer than this many seconds')
+    parser.add_argument('--genai-tables', type=int, help='Most relevant tables sent to GenAI for large schemas')
+    parser.add_argument('--genai-schema-tokens', type=int, help='Approximate token budget for the schema sent to GenAI')
+    parser.add_argument('--no-translation-cache', action='store_true', help='Always ask GenAI instead of reusing cached translations')
+    parser.add_argument('--timing', action='store_true', help='Show execute/fetch/convert/render times after each statement')
+    parser.add_argument('--no-banner', action='store_true', help='Skip the banner and its server status queries')
+    parser.add_argument('--profile-startup', action='store_true', help='Print how long each startup phase took')
+    parser.add_argument('-e', '--execute', help='Run these statements and exit (batch mode)')
+    parser.add_argument('-f', '--file', help='Run the statements in this script and exit ("-" reads stdin)')
+    parser.add_argument('--parallel', type=int, default=1, help='Spread batch statements over N connections')
+    parser.add_argument('--force', action='store_true', help='In batch mode, continue after a failed statement')
+    parser.add_argument('--profile', help=f'Connect with a named profile from {profiles_file}')
+
+    args = parser.parse_args()
+
+    # Override environment variables with command-line arguments
+    if args.user:
+        db_config['user'] = args.user
+    if args.password:
+        db_config['password'] = args.password
+    if args.host:
+        db_config['host'] = args.host
+    if args.database:
+        db_config['database'] = args.database
+    if args.port:
+        db_config['port'] = args.port
+    if args.no_password and 'password' in db_config:
+        del db_config['password']
+    global active_profile
+    profile_sessions['default'] = {'conn': None, 'config': dict(db_config), 'session_statements': []}
+    if args.profile and args.profile != "default":
+        config = profile_config(args.profile)
+        if config is None:
+            print(f"Unknown profile: {args.profile} (profiles are read from {profiles_file})")
+            sys.exit(1)
+        db_config.update(config)
+        active_profile = args.profile
+        profile_sessions[active_profile] = {'conn': None, 'config': config, 'session_statements': []}
+    if args.gemini_api_key:
+        global gemini_api_key
+        gemini_api_key = args.gemini_api_key
 
     if args.syntax_highlighting:
         syntax_highlighting_enabled = True  # Set the flag
+    if args.stream:
+        client_settings['stream'] = True
+    if args.schema_refresh is not None:
+        client_settings['schema_refresh_interval'] = args.schema_refresh
+    if args.timeout:
+        client_settings['statement_timeout'] = args.timeout
+    if args.timing:
+        client_settings['show_timing'] = True
+    if args.no_translation_cache:
+        client_settings['translation_cache'] = False
+    if args.genai_tables:
+        client_settings['genai_top_tables'] = args.genai_tables
+    if args.genai_schema_tokens:
+        client_settings['genai_schema_tokens'] = args.genai_schema_tokens
+
+    if args.execute is not None or args.file:
+        script = args.execute or ""
+        if args.file:
+            with (sys.stdin if args.file == "-" else open(args.file)) as f:
+                script += "\n" + f.read()
+        sys.exit(1 if run_batch(split_sql_statements(script), args.parallel, args.force) else 0)
+
+    mark_startup_phase("arguments")
 
     try:
-        conn = mysql.connector.connect(**db_config)
+        # Connect while prompt_toolkit is being imported
+        connect_executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        connect_future = connect_executor.submit(mysql.connector.connect, **db_config)
+        connect_executor.shutdown(wait=False)
+        create_prompt_session(syntax_highlighting_enabled)
+        mark_startup_phase("prompt session")
+
+        conn = connect_future.result()
         cur = conn.cursor(dictionary=True)
         conn.autocommit = False
+        profile_sessions[active_profile]['conn'] = conn
+        mark_startup_phase("connect (remaining wait)")
 
-        history = load_history(history_file)
+        open_history_store(history_db_file, history_file)
         sql_accumulator = ""
+        mark_startup_phase("history store")
 
-        infobanner(cur)
+        if not args.no_banner:
+            infobanner(cur)
+            mark_startup_phase("banner")
+        start_schema_refresh(syntax_highlighting_enabled)  # Only update the completer if syntax highlighting is on
+        mark_startup_phase("schema worker")
+        if args.profile_startup:
+            print_startup_profile()
 
         while True:
             current_db = conn.database
 
-            if schema is None or db_config['database'] != current_db:
-                schema = get_database_schema(cur)
+            if schema_needs_update or db_config['database'] != current_db:
                 db_config['database'] = current_db
-                completer_needs_update = True
-
-            if completer_needs_update and syntax_highlighting_enabled:  # Only update if syntax highlighting is on
-                update_completer(cur)
-                completer_needs_update = False
+                request_schema_refresh(current_db)  # Loads in the background, the prompt does not wait
+                schema_needs_update = False
 
             prompt = f"Mysql [{current_db}] SQL> " if current_db else "Mysql SQL> "
 
             try:
-                lexer = PygmentsLexer(MySqlLexer) if syntax_highlighting_enabled else None  # Use the flag
-                line = session.prompt(prompt, lexer=lexer)
+                line = session.prompt(prompt)
             except (KeyboardInterrupt, EOFError):
                 print("\nExiting...")
                 break
@@ -563,25 +3911,52 @@ def launch():
                 continue
 
             if line.strip() == "history":
-                last_100_keys = sorted(history.keys())[-100:]
-                for row_id in last_100_keys:
-                    print(f"{row_id}. {history[row_id]}")
+                for row_id, command in recent_history(100):
+                    print(f"{row_id}. {command}")
+                continue
+
+            if line.startswith("history "):
+                for row_id, command, executed_at, database, duration, rows in search_history(line[len("history "):].strip()):
+                    details = f"{time.strftime('%Y-%m-%d %H:%M', time.localtime(executed_at))} [{database}] {rows} rows, {duration:.3f} sec" if executed_at else ""
+                    print(f"{row_id}. {command}" + (f"   -- {details}" if details else ""))
+                continue
+
+            if line.startswith("\\"):
+                try:
+                    new_conn = run_meta_command(conn, line)
+                    if new_conn is not None:
+                        conn = new_conn
+                        cur = conn.cursor(dictionary=True)
+                        schema_needs_update = True
+                except mysql.connector.Error as err:
+                    print(f"Error: {err}")
+                except StatementAbandoned:
+                    print("Reconnecting...")
+                    new_conn = reconnect_or_report()
+                    if new_conn is not None:
+                        conn = new_conn
+                        cur = conn.cursor(dictionary=True)
+                        schema_needs_update = True
+                except KeyboardInterrupt:
+                    print("\nInterrupted")
+                except Exception as err:  # No backslash command may end the session
+                    print(f"Error: {type(err).__name__}: {err}")
                 continue
 
             if line.startswith("!"):
                 try:
                     # Try to convert to int first to see if it is a specific command number
                     cmd_num = int(line[1:])
-                    sql = history[cmd_num]  # Access history using row ID
+                    sql = get_history(cmd_num)  # Access history using row ID
+                    if sql is None:
+                        print("Invalid history command.")
+                        continue
                     print(f"Executing: {sql}")
                 except ValueError:
                     # If it's not an integer, then it's a partial match
-                    sql = execute_recent_match(history, line[1:])
+                    sql = execute_recent_match(line[1:])
                     if sql is None:
                         continue
-                except (IndexError):
-                    print("Invalid history command.")
-                    continue
             else:
                 sql_accumulator += line + "\n"
                 sql = sql_accumulator.strip()
@@ -590,56 +3965,85 @@ def launch():
             try:
                 if not conn.is_connected():
                     print("Connection lost. Reconnecting...")
-                    conn = reconnect(db_config)
+                    new_conn = reconnect_or_report()
+                    if new_conn is None:
+                        continue
+                    conn = new_conn
                     cur = conn.cursor(dictionary=True)
-                    completer_needs_update = True
+                    schema_needs_update = True
 
                 if sql.startswith("translate") or not sql.lstrip().upper().startswith(validSqlCommands):
-                    print(" --Requesting GenAI help")
-                    if model is None:
-                        model = get_top_flash_model()
-                    translate = sql[len("translate"):].strip()
-                    _sql, chat_history = askGemini(
-                        f"Answer with a single line Mysql SQL query to answer the following question '{translate}'. \n",
-                        schema,
-                        chat_history,
-                        model,
-                    )
-                    sql = extract_sql_command(_sql)
-                    if sql: # if it is a valid SQL command
-                        print(f" Running: {sql} ")
-
-                start_time = time.time()
-                cur.execute(sql)
-                rows_affected = cur.rowcount  # This is the key change
-                end_time = time.time()
-                execution_time = end_time - start_time
-
-                try:
-                    results = cur.fetchall()
-                    row_count = len(results)
-                    print_formatted_results(cur, results)
-                    if rows_affected > 0:
-                        print(f"{rows_affected} rows affected ({execution_time:.3f} sec)")
+                    bypass_cache = sql.startswith("translate!")  # "translate! ..." asks GenAI again
+                    translate = sql[len("translate!" if bypass_cache else "translate"):].strip() if sql.startswith("translate") else sql
+                    _database, tables, schema_str = wait_for_schema()
+                    cached_sql = None if bypass_cache else get_cached_translation(translate, schema_str)
+                    if cached_sql:
+                        sql = cached_sql
+                        print(f" Running (cached): {sql} ")
                     else:
-                        print(f"{row_count} rows returnned ({execution_time:.3f} sec)")
-                except mysql.connector.errors.ProgrammingError:
-                    print(f"Error: {rows_affected} rows affected.")  # Show affected rows
+                        if not gemini_api_key:
+                            print("GenAI needs a Gemini API key (set GEMINI_API_KEY or use -g)")
+                            continue
+                        print(" --Requesting GenAI help")
+                        if model is None:
+                            model = get_top_flash_model() or "gemini-2.0-flash"
+                        _sql, chat_history = askGemini(
+                            f"Answer with a single line Mysql SQL query to answer the following question '{translate}'. \n",
+                            select_schema_context(tables, translate, chat_history),
+                            chat_history,
+                            model,
+                            session_key=schema_str,
+                        )
+                        sql = extract_sql_command(_sql)
+                        if not sql:
+                            continue
+                        cache_translation(translate, schema_str, sql)
+                        print(f" Running: {sql} ")
 
-                history[len(history) + 1] = sql  # Add command to history with new row ID
-                save_history(history_file)
+                sql, export_path = split_into_local(sql)
+                export_path = export_path or client_settings['output_file']
+                if export_path:
+                    fmt = export_format(export_path)
+                    if fmt is None:
+                        continue
+                    result = run_cancellable(conn, export_statement, conn, sql, export_path, fmt)
+                else:
+                    result = run_cancellable(conn, run_statement, conn, cur, sql)
+                if result is not None:
+                    row_count, execution_time = result
+                    add_history(sql, current_db, execution_time, row_count)
+                    remember_session_statement(sql)
+                    if client_settings['auto_explain'] and execution_time >= client_settings['auto_explain'] and sql.lstrip().upper().startswith("SELECT"):
+                        explain_statement(conn, sql)
                 conn.commit()
 
             except mysql.connector.Error as err:
                 print(f"Error: {err}")
-                if err.errno == mysql.connector.errorcode.CR_SERVER_LOST:
-                    conn = reconnect(db_config)
+                if err.errno in RECONNECT_ERRORS:
+                    new_conn = reconnect_or_report()
+                    if new_conn is not None:
+                        conn = new_conn
+                        cur = conn.cursor(dictionary=True)
+                        schema_needs_update = True
+            except StatementAbandoned:
+                print("Reconnecting...")
+                new_conn = reconnect_or_report()
+                if new_conn is not None:
+                    conn = new_conn
                     cur = conn.cursor(dictionary=True)
-                    completer_needs_update = True
+                    schema_needs_update = True
+            except KeyboardInterrupt:
+                print("\nCancelled")
 
     except mysql.connector.Error as err:
         print(f"Error connecting to MySQL Platform: {err}")
     finally:
+        for state in profile_sessions.values():
+            if state['conn'] is not None and state['conn'] is not conn:
+                try:
+                    state['conn'].close()
+                except mysql.connector.Error:
+                    pass
         if conn and conn.is_connected():
             conn.close()
                         
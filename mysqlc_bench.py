@@ -0,0 +1,401 @@
+#!/usr/bin/env python3
+"""
+Offline benchmarks for mysqlc's client-side hot paths.
+
+Every workload runs against a fake connector that serves generated rows, so
+no server or network is needed: 10k-table schemas, million-row and very
+wide result sets, and 500k-entry history files. Each workload reports its
+wall time and peak Python memory (tracemalloc), and is compared with the
+stored baseline in bench_baseline.json.
+
+    python mysqlc_bench.py                  # run everything (a few minutes), compare with the baseline
+    python mysqlc_bench.py --scale 0.1      # smaller workloads for a quick check
+    python mysqlc_bench.py --only schema    # workloads whose name contains "schema"
+    python mysqlc_bench.py --save-baseline  # record the current numbers
+    python mysqlc_bench.py --live           # result set workloads against DB_* from the environment
+
+The exit status is 1 when a workload is slower (or uses more memory) than
+its baseline by more than --threshold.
+"""
+import os
+import io
+import gc
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+import tracemalloc
+import functools
+import contextlib
+
+import mysqlc
+
+baseline_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bench_baseline.json')
+work_dir = None  # Temporary directory for generated files, set by main()
+
+# Registered workloads, name -> (setup, run); setup(scale) returns the arguments for run
+workloads = {}
+
+def workload(name):
+    """Registers a workload as a (setup, run) pair built by the decorated function."""
+    def register(func):
+        workloads[name] = func()
+        return func
+    return register
+
+class FakeCursor:
+    """
+    A cursor over generated rows, implementing the part of the
+    mysql.connector cursor API mysqlc uses.
+
+    Args:
+        responder: Called with (sql, params), returns (column names, rows as tuples).
+        dictionary: Return rows as dicts, like cursor(dictionary=True).
+    """
+
+    def __init__(self, responder, dictionary=False):
+        self.responder = responder
+        self.dictionary = dictionary
+        self.description = None
+        self.rowcount = -1
+        self.rows = []
+        self.position = 0
+
+    def execute(self, sql, params=None):
+        columns, rows = self.responder(sql, params)
+        self.description = [(name, 253, None, None, None, None, 1, 0, 0) for name in columns] if columns else None
+        self.rows = [dict(zip(columns, row)) for row in rows] if self.dictionary else rows
+        self.rowcount = len(rows)
+        self.position = 0
+
+    def fetchmany(self, size=1):
+        batch = self.rows[self.position:self.position + size]
+        self.position += len(batch)
+        return batch
+
+    def fetchall(self):
+        return self.fetchmany(len(self.rows) - self.position)
+
+    def fetchone(self):
+        batch = self.fetchmany(1)
+        return batch[0] if batch else None
+
+    def close(self):
+        pass
+
+@functools.lru_cache(maxsize=2)
+def result_rows(row_count, column_count):
+    """Returns column names and rows of mixed ints, floats, short strings and NULLs (cached, do not modify)."""
+    columns = [f"col{i}" for i in range(column_count)]
+    rows = []
+    for n in range(row_count):
+        rows.append(tuple(
+            n if i == 0 else None if (n + i) % 17 == 0 else n * 0.25 if i % 3 == 1 else f"value-{n % 1000}-{i}"
+            for i in range(column_count)))
+    return columns, rows
+
+def schema_responder(table_count, columns_per_table):
+    """Returns a responder serving the two information_schema queries of get_schema_tables()."""
+    types = ["int", "bigint unsigned", "varchar(255)", "datetime", "decimal(10,2)", "text", "json"]
+    column_rows = []
+    for t in range(table_count):
+        for c in range(columns_per_table):
+            column_rows.append((f"table_{t:05d}_{('orders', 'users', 'events', 'items')[t % 4]}",
+                                "id" if c == 0 else f"field_{c}_{('name', 'created_at', 'amount', 'status')[c % 4]}",
+                                types[c % len(types)], "PRI" if c == 0 else ""))
+
+    def respond(sql, params):
+        if "COUNT(*) AS table_count" in sql:
+            return (["database_name", "table_count", "max_create_time", "column_summary"],
+                    [("bench", table_count, "2024-01-01 00:00:00", f"{len(column_rows)}:123456789")])
+        return ["table_name", "column_name", "column_type", "column_key"], column_rows
+    return respond
+
+def make_schema(scale):
+    """Returns the tables dict of a synthetic 10k-table schema (scaled)."""
+    cursor = FakeCursor(schema_responder(max(1, int(10000 * scale)), 12), dictionary=True)
+    mysqlc.schema_tables_cache.clear()
+    return mysqlc.get_schema_tables(cursor)
+
+def write_history_file(path, entries):
+    """Writes an old-style history file with entries commands, some of them multi-line."""
+    random.seed(1)
+    with open(path, 'w') as f:
+        for n in range(entries):
+            f.write(f"\n# {n}\n")
+            if n % 10 == 0:
+                f.write(f"+SELECT id, name\n+FROM table_{n % 5000} WHERE id = {n}\n")
+            else:
+                f.write(f"+SELECT * FROM table_{random.randrange(5000)} WHERE status = 'open' LIMIT {n % 100}\n")
+
+@workload("format_results_1m_rows")
+def bench_format_results():
+    def setup(scale):
+        columns, rows = result_rows(int(1000000 * scale), 5)
+        cursor = FakeCursor(lambda sql, params: (columns, rows), dictionary=True)
+        cursor.execute("SELECT")
+        return cursor, cursor.fetchall()
+    return setup, mysqlc.print_formatted_results
+
+@workload("format_results_wide")
+def bench_format_wide():
+    def setup(scale):
+        columns, rows = result_rows(int(10000 * scale), 300)
+        cursor = FakeCursor(lambda sql, params: (columns, rows), dictionary=True)
+        cursor.execute("SELECT")
+        return cursor, cursor.fetchall()
+    return setup, mysqlc.print_formatted_results
+
+@workload("stream_results_1m_rows")
+def bench_stream_results():
+    def setup(scale):
+        columns, rows = result_rows(int(1000000 * scale), 5)
+        cursor = FakeCursor(lambda sql, params: (columns, rows))
+        cursor.execute("SELECT")
+        return columns, cursor
+
+    def run(columns, cursor):
+        mysqlc.print_streamed_results(columns, mysqlc.fetch_batches(cursor, mysqlc.client_settings['stream_batch_rows']))
+    return setup, run
+
+@workload("last_result_store_1m_rows")
+def bench_last_results():
+    def setup(scale):
+        columns, rows = result_rows(int(1000000 * scale), 4)
+        mysqlc.last_results.clear()
+        mysqlc.client_settings['last_results_mb'] = 1024  # The default cap would not keep a million rows
+        return columns, [list(values) for values in zip(*rows)]
+
+    def run(columns, data):
+        mysqlc.remember_result("SELECT", columns, data)
+        result = mysqlc.last_results[0]
+        mysqlc.select_last_rows(result, "where col1 > 1000 and col2 like 'value-1%' sort col1 desc head 50")
+    return setup, run
+
+@workload("load_history_500k")
+def bench_load_history():
+    def setup(scale):
+        path = os.path.join(work_dir, 'legacy.history')
+        write_history_file(path, int(500000 * scale))
+        return (path,)
+    return setup, mysqlc.load_history
+
+@workload("history_import_500k")
+def bench_history_import():
+    def setup(scale):
+        path = os.path.join(work_dir, 'legacy.history')
+        write_history_file(path, int(500000 * scale))
+        db_file = os.path.join(work_dir, 'import.db')
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(db_file + suffix):
+                os.remove(db_file + suffix)
+        return db_file, path
+
+    def run(db_file, path):
+        mysqlc.open_history_store(db_file, path).close()
+    return setup, run
+
+@workload("history_search_500k")
+def bench_history_search():
+    def setup(scale):
+        path = os.path.join(work_dir, 'legacy.history')
+        write_history_file(path, int(500000 * scale))
+        db_file = os.path.join(work_dir, 'search.db')
+        if not os.path.exists(db_file):
+            mysqlc.open_history_store(db_file, path).close()
+        mysqlc.open_history_store(db_file)
+        return ()
+
+    def run():
+        for n in range(100):
+            mysqlc.search_history(f"table_{n * 37}", 100)
+            mysqlc.execute_recent_match(f"SELECT * FROM table_{n * 41}")
+        mysqlc.recent_history(100)
+        mysqlc.history_db.close()
+    return setup, run
+
+@workload("schema_introspect_10k_tables")
+def bench_schema_introspect():
+    def setup(scale):
+        mysqlc.schema_tables_cache.clear()
+        for name in os.listdir(mysqlc.cache_dir) if os.path.isdir(mysqlc.cache_dir) else []:
+            os.remove(os.path.join(mysqlc.cache_dir, name))
+        return (FakeCursor(schema_responder(max(1, int(10000 * scale)), 12), dictionary=True),)
+    return setup, mysqlc.get_database_schema
+
+@workload("schema_disk_cache_10k_tables")
+def bench_schema_disk_cache():
+    def setup(scale):
+        cursor = FakeCursor(schema_responder(max(1, int(10000 * scale)), 12), dictionary=True)
+        mysqlc.get_schema_tables(cursor)  # Fills the disk cache
+        mysqlc.schema_tables_cache.clear()
+        return (cursor,)
+    return setup, mysqlc.get_schema_tables
+
+@workload("update_completer_10k_tables")
+def bench_update_completer():
+    def setup(scale):
+        return (make_schema(scale),)
+    return setup, mysqlc.update_completer
+
+@workload("completions_10k_tables")
+def bench_completions():
+    def setup(scale):
+        mysqlc.update_completer(make_schema(scale))
+        return ()
+
+    def run():
+        for n in range(200):
+            mysqlc.sql_completions(f"SELECT * FROM table_{n:03d}")
+            mysqlc.sql_completions(f"SELECT t.fi FROM table_{n:05d}_orders t WHERE t.fi")
+            mysqlc.sql_completions("sel")
+    return setup, run
+
+@workload("genai_context_10k_tables")
+def bench_genai_context():
+    def setup(scale):
+        mysqlc.schema_token_index = (None, None)
+        return make_schema(scale), "total amount of orders per status created_at last week"
+    return setup, mysqlc.select_schema_context
+
+@workload("split_statements_200k")
+def bench_split_statements():
+    def setup(scale):
+        statements = [f"INSERT INTO t VALUES ({n}, 'a;b', \"c\"); -- row {n}\n" for n in range(int(200000 * scale))]
+        return ("".join(statements),)
+    return setup, mysqlc.split_sql_statements
+
+def live_responder(conn):
+    """Returns a responder for --live that generates result rows on the server with a recursive CTE."""
+    import mysql.connector
+
+    def respond(sql, params):
+        row_count, column_count = params
+        cursor = conn.cursor()
+        try:
+            cursor.execute(f"SET SESSION cte_max_recursion_depth = {row_count + 1}")
+        except mysql.connector.Error:
+            cursor.execute(f"SET SESSION max_recursive_iterations = {row_count + 1}")  # MariaDB
+        expressions = ", ".join(f"IF(MOD(n + {i}, 17) = 0, NULL, CONCAT('value-', MOD(n, 1000), '-{i}')) AS col{i}"
+                                for i in range(1, column_count))
+        cursor.execute(f"WITH RECURSIVE seq (n) AS (SELECT 0 UNION ALL SELECT n + 1 FROM seq WHERE n < {row_count - 1}) "
+                       f"SELECT n AS col0, {expressions} FROM seq")
+        rows = cursor.fetchall()
+        columns = [desc[0] for desc in cursor.description]
+        cursor.close()
+        return columns, rows
+    return respond
+
+def use_live_server():
+    """Replaces the generated result sets with rows produced by the server in mysqlc.db_config."""
+    import mysql.connector
+
+    conn = mysql.connector.connect(**mysqlc.db_config)
+    respond = live_responder(conn)
+
+    def live_setup(row_count, column_count, dictionary):
+        def setup(scale):
+            cursor = FakeCursor(respond, dictionary=dictionary)
+            cursor.execute("SELECT", (max(1, int(row_count * scale)), column_count))
+            return cursor
+        return setup
+
+    format_setup = live_setup(1000000, 5, True)
+    wide_setup = live_setup(10000, 300, True)
+    stream_setup = live_setup(1000000, 5, False)
+    workloads["format_results_1m_rows"] = (lambda scale: (lambda c: (c, c.fetchall()))(format_setup(scale)),
+                                           mysqlc.print_formatted_results)
+    workloads["format_results_wide"] = (lambda scale: (lambda c: (c, c.fetchall()))(wide_setup(scale)),
+                                        mysqlc.print_formatted_results)
+    workloads["stream_results_1m_rows"] = (
+        lambda scale: (lambda c: ([desc[0] for desc in c.description], c))(stream_setup(scale)),
+        workloads["stream_results_1m_rows"][1])
+
+def measure(setup, run, scale):
+    """
+    Runs one workload twice, once for the time and once under tracemalloc for
+    the peak memory, so the tracing overhead does not count in the time.
+
+    Returns:
+        (seconds, peak megabytes)
+    """
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        args = setup(scale)
+        gc.collect()
+        start_time = time.perf_counter()
+        run(*args)
+        seconds = time.perf_counter() - start_time
+
+        args = setup(scale)
+        gc.collect()
+        tracemalloc.start()
+        run(*args)
+        _current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    return seconds, peak / 1048576
+
+def main():
+    global work_dir
+    parser = argparse.ArgumentParser(description='Offline benchmarks for mysqlc hot paths')
+    parser.add_argument('--scale', type=float, default=1.0, help='Multiply the workload sizes (baselines are for 1.0)')
+    parser.add_argument('--only', help='Run only workloads whose name contains this text')
+    parser.add_argument('--threshold', type=float, default=0.25, help='Allowed slowdown/growth over the baseline (0.25 = 25%%)')
+    parser.add_argument('--save-baseline', action='store_true', help=f'Store the results in {baseline_file}')
+    parser.add_argument('--live', action='store_true', help='Generate result sets on the server from DB_* settings')
+    parser.add_argument('--json', help='Also write the results to this file')
+    args = parser.parse_args()
+
+    # Keep caches and history files of the benchmark out of the user's home directory
+    work_dir = tempfile.mkdtemp(prefix="mysqlc-bench-")
+    mysqlc.cache_dir = os.path.join(work_dir, 'cache')
+    mysqlc.db_config.update({'user': 'bench', 'host': 'localhost', 'database': 'bench'})
+    if args.live:
+        use_live_server()
+
+    try:
+        with open(baseline_file) as f:
+            baseline = json.load(f)
+    except (OSError, ValueError):
+        baseline = {}
+    if args.scale != 1.0:
+        if args.save_baseline:
+            print("Baselines are only saved for --scale 1.0")
+            return
+        baseline = {}  # Baselines only describe full-size runs
+
+    results = {}
+    regressions = []
+    print(f"{'workload':<32} {'seconds':>9} {'peak MB':>9} {'baseline s':>11} {'baseline MB':>12}")
+    for name, (setup, run) in workloads.items():
+        if args.only and args.only not in name:
+            continue
+        seconds, peak = measure(setup, run, args.scale)
+        results[name] = {'seconds': round(seconds, 4), 'peak_mb': round(peak, 2)}
+        reference = baseline.get(name)
+        flag = ""
+        if reference:
+            if seconds > reference['seconds'] * (1 + args.threshold) and seconds - reference['seconds'] > 0.05:
+                flag += f" SLOWER x{seconds / reference['seconds']:.2f}"
+            if peak > reference['peak_mb'] * (1 + args.threshold) and peak - reference['peak_mb'] > 1:
+                flag += f" MORE MEMORY x{peak / reference['peak_mb']:.2f}"
+            if flag:
+                regressions.append(name)
+        print(f"{name:<32} {seconds:>9.3f} {peak:>9.1f} "
+              f"{reference['seconds'] if reference else '-':>11} {reference['peak_mb'] if reference else '-':>12}{flag}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.save_baseline:
+        baseline.update(results)
+        with open(baseline_file, 'w') as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+        print(f"Baseline saved to {baseline_file}")
+    if regressions:
+        print(f"{len(regressions)} workload(s) regressed: {', '.join(regressions)}")
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+"""
+Checks analyze_plan() against EXPLAIN FORMAT=JSON plans recorded from MySQL and MariaDB.
+
+Run with: python -m pytest -q tests
+"""
+
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import mysqlc
+
+PLANS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'explain_plans')
+
+TABLES = {
+    'orders': [['id', 'int', 'PRI'], ['customer_id', 'int', 'MUL'], ['status', 'varchar(16)', ''],
+               ['total', 'decimal(10,2)', ''], ['created_at', 'datetime', '']],
+    'customers': [['id', 'int', 'PRI'], ['name', 'varchar(64)', '']],
+    'events': [['id', 'bigint', 'PRI'], ['session_token', 'char(32)', ''], ['created_at', 'datetime', 'MUL']],
+    'sessions': [['id', 'bigint', 'PRI'], ['token', 'char(32)', ''], ['country', 'char(2)', '']],
+}
+
+def load_plan(name):
+    with open(os.path.join(PLANS_DIR, f"{name}.json"), encoding='utf-8') as plan_file:
+        return json.load(plan_file)
+
+def test_mysql_nested_loop_filesort():
+    sql = ("SELECT c.name, o.total FROM orders o JOIN customers c ON c.id = o.customer_id "
+           "WHERE o.status = 'paid' AND o.created_at >= '2024-01-01' ORDER BY o.total DESC")
+    rows, warnings, suggestions = mysqlc.analyze_plan(load_plan('mysql_nested_loop_filesort'), TABLES, sql)
+
+    assert rows == [('o', 'ALL', None, 199870, '10.00'), ('c', 'eq_ref', 'PRIMARY', 1, '100.00')]
+    assert warnings == [
+        "Full table scan on o (~199,870 rows)",
+        "o: possible keys idx_customer are not used",
+        "Large row estimate for o: 199,870 examined per scan, 19,987 produced by the join",
+        "Using filesort (ORDER BY/GROUP BY cannot use an index)",
+    ]
+    assert suggestions == ["ALTER TABLE `orders` ADD INDEX `idx_orders_status_created_at` (`status`, `created_at`)"]
+
+def test_mariadb_block_nl_join():
+    sql = ("SELECT * FROM events e JOIN sessions s ON s.token = e.session_token "
+           "WHERE e.created_at > '2024-06-01' AND s.country = 'DE'")
+    rows, warnings, suggestions = mysqlc.analyze_plan(load_plan('mariadb_block_nl_join'), TABLES, sql)
+
+    assert rows == [('e', 'range', 'idx_created', 4210, 100), ('s', 'ALL', None, 8120, 100)]
+    assert warnings == [
+        "Full table scan on s (~8,120 rows)",
+        "Join order: s is joined without a usable index and is scanned for rows of the earlier tables",
+    ]
+    # the join condition sits on the block-nl-join node, not on the buffered table
+    assert suggestions == ["ALTER TABLE `sessions` ADD INDEX `idx_sessions_token_country` (`token`, `country`)"]
+
+def test_mysql_ref_lookup_is_clean():
+    sql = "SELECT * FROM orders WHERE customer_id = 42"
+    rows, warnings, suggestions = mysqlc.analyze_plan(load_plan('mysql_ref_lookup'), TABLES, sql)
+
+    assert rows == [('orders', 'ref', 'idx_customer', 7, '100.00')]
+    assert warnings == []
+    assert suggestions == []